@@ -3,15 +3,23 @@ import os
 import json
 import numpy as np
 import time
-import glob
-import psutil
 import uuid
 import pyarrow.parquet as pq
 import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.dataset as ds
 import threading
+import asyncio
+import sqlite3
+import hashlib
+from contextlib import contextmanager
+from collections import OrderedDict, deque
+from queue import Full
+import multiprocessing
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, as_completed
 from werkzeug.exceptions import RequestTimeout
 import boto3
-import zipfile, io, joblib
+import zipfile, io, joblib, gzip
 from flask import Flask, render_template, request, jsonify, Response, session
 from flask_cors import CORS, cross_origin
 from dotenv import load_dotenv
@@ -20,24 +28,57 @@ load_dotenv()
 
 
 app = Flask(__name__, template_folder='public')
+CORS_ORIGINS = [
+    "http://165.227.70.245:3000",
+    "http://localhost:3000"
+]
 CORS(app, resources={
     r"/*": {
-        "origins": [
-            "http://165.227.70.245:3000",
-            "http://localhost:3000"
-        ]
+        "origins": CORS_ORIGINS
     }
 })
 
-CPU_THRESHOLD = float(os.getenv("CPU_THRESHOLD", "25"))
-MEMORY_THRESHOLD_GB = float(os.getenv("MEMORY_THRESHOLD_GB", "8"))
+CONVERT_LAYOUT = os.getenv("CONVERT_LAYOUT", "country")  # "country" (sorted, row groups per country) or "plain"
+CONVERT_ROW_GROUP_SIZE = int(os.getenv("CONVERT_ROW_GROUP_SIZE", "262144"))
+CONVERT_MEMORY_BUDGET_MB = float(os.getenv("CONVERT_MEMORY_BUDGET_MB", "512"))
+CONVERT_WORKERS = int(os.getenv("CONVERT_WORKERS", str(min(4, os.cpu_count() or 1))))
+# Peak memory of a worker converting one year, as a multiple of the year's decoded
+# size: the table as read (Parquet decode buffers included) plus its sorted copy
+CONVERT_YEAR_MEMORY_FACTOR = 3
+# Also write an uncompressed, memory-mappable Arrow IPC copy of every year file
+CONVERT_ARROW_COPY = os.getenv("CONVERT_ARROW_COPY", "false").lower() in ("1", "true", "yes")
 DATA_FOLDER = "data/modis"  # Added this for consistency with analysis endpoints
+DETAIL_INDEX_DIR = os.getenv("DETAIL_INDEX_DIR", os.path.join(DATA_FOLDER, ".detail_index"))
+TILE_INDEX_DIR = os.getenv("TILE_INDEX_DIR", os.path.join(DATA_FOLDER, ".tile_index"))
+TILE_GRID_DEG = float(os.getenv("TILE_GRID_DEG", "0.25"))  # spatial index cell size in degrees
+TILE_FULL_ZOOM = int(os.getenv("TILE_FULL_ZOOM", "9"))  # from this zoom up, viewports return every point
+TILE_CLUSTER_PX = int(os.getenv("TILE_CLUSTER_PX", "8"))  # below it, one point per cluster of this many pixels
+HEATMAP_RESOLUTION = float(os.getenv("HEATMAP_RESOLUTION", "0.5"))  # default heatmap cell size in degrees
+HEATMAP_CACHE_SIZE = int(os.getenv("HEATMAP_CACHE_SIZE", "128"))
+CATALOG_SYNC_INTERVAL = float(os.getenv("CATALOG_SYNC_INTERVAL", "5"))  # seconds between data folder checks
+YEAR_CACHE_MB = float(os.getenv("YEAR_CACHE_MB", "1024"))  # decoded year tables kept in memory
+ANALYSIS_CACHE_SIZE = int(os.getenv("ANALYSIS_CACHE_SIZE", "64"))
+ANALYSIS_CACHE_TTL = float(os.getenv("ANALYSIS_CACHE_TTL", "3600"))  # seconds
+ANALYSIS_WORKERS = int(os.getenv("ANALYSIS_WORKERS", "2"))
+ANALYSIS_QUEUE_SIZE = int(os.getenv("ANALYSIS_QUEUE_SIZE", "32"))
+ANALYSIS_MEMORY_BUDGET_MB = float(os.getenv("ANALYSIS_MEMORY_BUDGET_MB", "2048"))
+RESULTS_TTL = float(os.getenv("RESULTS_TTL", "3600"))  # seconds a finished session's results (and progress) are kept
+RESULTS_MEMORY_MB = float(os.getenv("RESULTS_MEMORY_MB", "256"))
+RESULTS_MAX_SESSIONS = int(os.getenv("RESULTS_MAX_SESSIONS", "1000"))
+RESULTS_SPILL_DIR = os.getenv("RESULTS_SPILL_DIR", os.path.join(DATA_FOLDER, ".results"))  # empty disables spilling
+
+# SQLite file holding job progress, stop requests and results for all worker
+# processes (gunicorn/uvicorn --workers); empty keeps that state in this process
+SHARED_STATE_DB = os.getenv("SHARED_STATE_DB", "")
+SHARED_STATE_POLL = float(os.getenv("SHARED_STATE_POLL", "0.25"))  # seconds between checks for other processes' updates
 
 # Global dict to track analysis progress for different sessions
 analysis_progress = {}
-
-# Flag to signal analysis to stop
-should_stop_analysis = False
+# Seconds an idle SSE stream waits before sending a keep-alive comment
+PROGRESS_HEARTBEAT = float(os.getenv("PROGRESS_HEARTBEAT", "15"))
+# Progress milestones of an analysis job: sources planned, all row groups read
+PROGRESS_PLANNED = 5
+PROGRESS_SCANNED = 90
 
 # -------------------------------
 # Config: R2 / S3 Configuration
@@ -63,66 +104,290 @@ s3 = boto3.client(
 # Config: Prediction
 # -------------------------------
 PACKAGE_PATH = "predict_package.model"
+MODEL_CACHE_SIZE = int(os.getenv("MODEL_CACHE_SIZE", "8"))
+PREDICT_BATCH_WORKERS = int(os.getenv("PREDICT_BATCH_WORKERS", "4"))
+PREDICT_BATCH_MAX = int(os.getenv("PREDICT_BATCH_MAX", "500"))  # countries x start dates per batch request
+# empty string disables the cache; the default lives next to app.py whatever the working directory
+PREDICT_CACHE_DB = os.getenv("PREDICT_CACHE_DB", os.path.join(os.path.dirname(os.path.abspath(__file__)), "predict_cache.sqlite"))
+PREDICT_PREWARM_WEEKS = int(os.getenv("PREDICT_PREWARM_WEEKS", "0"))
+
+# -------------------------------
+# Class: Model registry
+# -------------------------------
+class ModelRegistry:
+    """
+    Process-wide LRU cache of loaded prediction packages, one entry per country.
+    Each entry holds the meta JSON, the deserialized model and the processed frame.
+    Entries are keyed by the package file's version (mtime + size), so replacing
+    predict_package.model on disk invalidates everything loaded from the old file.
+    """
+
+    def __init__(self, max_size=MODEL_CACHE_SIZE):
+        self.max_size = max(1, max_size)
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._loading = {}  # key -> lock, so concurrent misses load a country once
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    @staticmethod
+    def package_version(package_path):
+        st = os.stat(package_path)
+        return (st.st_mtime_ns, st.st_size)
+
+    @staticmethod
+    def _load(country, package_path):
+        with zipfile.ZipFile(package_path, 'r') as zf:
+            # metadata
+            with zf.open(f"{country}_meta.json") as mf:
+                meta = json.load(io.TextIOWrapper(mf, encoding='utf-8'))
+            # model
+            with zf.open(f"{country}.joblib") as modf:
+                model = joblib.load(modf)
+            # processed parquet
+            buf = io.BytesIO(zf.read(f"{country}_processed.parquet"))
+            table = pq.read_table(buf)
+            proc = table.to_pandas()
+        proc["acq_date"] = pd.to_datetime(proc["acq_date"])
+        return {"meta": meta, "model": model, "proc": proc}
+
+    def get(self, country, package_path=PACKAGE_PATH):
+        """Return the cached {meta, model, proc} entry, loading it on a miss."""
+        path = os.path.abspath(package_path)
+        version = self.package_version(path)
+        key = (path, country)
+
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                if entry["version"] == version:
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return entry
+                # Package was replaced on disk: drop everything from the old file
+                stale = [k for k, e in self._entries.items() if k[0] == path and e["version"] != version]
+                for k in stale:
+                    del self._entries[k]
+                self.invalidations += len(stale)
+            loading = self._loading.setdefault(key, threading.Lock())
+
+        with loading:
+            with self._lock:
+                # Loaded by a concurrent miss while we waited
+                entry = self._entries.get(key)
+                if entry is not None and entry["version"] == version:
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return entry
+                self.misses += 1
+
+            # Load outside the lock so other countries are not blocked by a slow unzip
+            entry = self._load(country, path)
+            entry["version"] = version
+
+            with self._lock:
+                self._loading.pop(key, None)
+                self._entries[key] = entry
+                self._entries.move_to_end(key)
+                while len(self._entries) > self.max_size:
+                    self._entries.popitem(last=False)
+                    self.evictions += 1
+            return entry
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "size": len(self._entries),
+                "max_size": self.max_size,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "invalidations": self.invalidations,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+                "countries": [k[1] for k in self._entries],
+            }
+
+
+model_registry = ModelRegistry()
+
+# -------------------------------
+# Class: Prediction result cache
+# -------------------------------
+_package_hashes = {}
+
+
+def package_fingerprint(package_path=PACKAGE_PATH):
+    """SHA-256 of the package file, recomputed only when its mtime/size change."""
+    path = os.path.abspath(package_path)
+    version = ModelRegistry.package_version(path)
+    cached = _package_hashes.get(path)
+    if cached and cached[0] == version:
+        return cached[1]
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(chunk)
+    _package_hashes[path] = (version, digest.hexdigest())
+    return _package_hashes[path][1]
+
+
+class PredictionStore:
+    """
+    Persistent SQLite cache of predict_from_package results.
+    For a given package, country and start date the prediction is deterministic,
+    so results are stored under (package hash, country, start_date) and served
+    as lookups until a different package is installed.
+    """
+
+    def __init__(self, db_path=PREDICT_CACHE_DB):
+        self.db_path = db_path
+        self.hits = 0
+        self.misses = 0
+        if self.enabled:
+            with self._connect() as conn:
+                conn.execute("""
+                    CREATE TABLE IF NOT EXISTS predictions (
+                        package_hash TEXT NOT NULL,
+                        country TEXT NOT NULL,
+                        start_date TEXT NOT NULL,
+                        result TEXT NOT NULL,
+                        created_at REAL NOT NULL,
+                        PRIMARY KEY (package_hash, country, start_date)
+                    )
+                """)
+
+    @property
+    def enabled(self):
+        return bool(self.db_path)
+
+    @contextmanager
+    def _connect(self):
+        # sqlite3's own context manager only commits; close the connection as well
+        conn = sqlite3.connect(self.db_path, timeout=30)
+        try:
+            conn.execute("PRAGMA journal_mode=WAL")
+            with conn:
+                yield conn
+        finally:
+            conn.close()
+
+    def get(self, package_hash, country, start_date):
+        with self._connect() as conn:
+            row = conn.execute(
+                "SELECT result FROM predictions WHERE package_hash = ? AND country = ? AND start_date = ?",
+                (package_hash, country, start_date)
+            ).fetchone()
+        if row is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return json.loads(row[0])
+
+    def put(self, package_hash, country, start_date, result):
+        with self._connect() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO predictions VALUES (?, ?, ?, ?, ?)",
+                (package_hash, country, start_date, json.dumps(result), time.time())
+            )
+
+    def purge_except(self, package_hash):
+        """Drop rows produced by any other package version."""
+        with self._connect() as conn:
+            return conn.execute("DELETE FROM predictions WHERE package_hash != ?", (package_hash,)).rowcount
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        info = {
+            "enabled": self.enabled,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+        }
+        if self.enabled:
+            with self._connect() as conn:
+                info["rows"] = conn.execute("SELECT COUNT(*) FROM predictions").fetchone()[0]
+        return info
+
+
+prediction_store = PredictionStore()
 
 # -------------------------------
 # Function: Prediction
 # -------------------------------
+def date_features(sd, days=7):
+    """Cyclical calendar features for each day of the forecast window."""
+    rows = []
+    for day in range(days):
+        d = sd + timedelta(days=day)
+        doy = d.timetuple().tm_yday
+        m = d.month
+        rows.append({
+            "day_of_year": doy,
+            "day_sin": np.sin(2 * np.pi * doy / 365.25),
+            "day_cos": np.cos(2 * np.pi * doy / 365.25),
+            "month": m,
+            "month_sin": np.sin(2 * np.pi * m / 12),
+            "month_cos": np.cos(2 * np.pi * m / 12),
+        })
+    return rows
+
+
+def build_feature_matrix(meta, proc, sd, days=7):
+    """
+    Build one (areas x days) feature frame for every area that has an anchor row.
+    The anchor is the last row per area on min(latest processed date, start date).
+    Returns the list of areas (in meta order) and the frame, `days` rows per area.
+    """
+    anchor = min(proc.acq_date.max(), sd)
+    anchor_rows = proc[proc.acq_date == anchor].drop_duplicates("area", keep="last")
+    anchor_rows = anchor_rows.set_index("area")
+
+    areas = [area for area in meta["areas"] if area in anchor_rows.index]
+    base = anchor_rows.loc[areas] if areas else anchor_rows.iloc[0:0]
+
+    calendar = date_features(sd, days)
+    columns = {}
+    for feat in meta["features"]:
+        if feat in calendar[0]:
+            columns[feat] = np.tile([row[feat] for row in calendar], len(areas))
+        elif feat == "area_code":
+            codes = [meta["area_map"].get(area, -1) for area in areas]
+            columns[feat] = np.repeat(np.asarray(codes, dtype=np.int64), days)
+        elif feat in base.columns:
+            columns[feat] = np.repeat(base[feat].to_numpy(), days)
+        else:
+            columns[feat] = np.zeros(len(areas) * days, dtype=np.int64)
+
+    return areas, pd.DataFrame(columns, columns=meta["features"])
+
+
 def predict_from_package(country: str, start_date: str, package_path: str = PACKAGE_PATH) -> dict:
-    # 1) Load meta, model, and processed data from the single .model (zip)
-    with zipfile.ZipFile(package_path, 'r') as zf:
-        # metadata
-        with zf.open(f"{country}_meta.json") as mf:
-            meta = json.load(io.TextIOWrapper(mf, encoding='utf-8'))
-        # model
-        with zf.open(f"{country}.joblib") as modf:
-            model = joblib.load(modf)
-        # processed parquet
-        buf = io.BytesIO(zf.read(f"{country}_processed.parquet"))
-        table = pq.read_table(buf)
-        proc = table.to_pandas()
-
-    # 2) Prediction logic (same as before)
-    proc["acq_date"] = pd.to_datetime(proc["acq_date"])
+    # 1) Load meta, model, and processed data (cached per package version)
+    entry = model_registry.get(country, package_path)
+    meta = entry["meta"]
+    model = entry["model"]
+    proc = entry["proc"]
+
+    # 2) Prediction logic: one batched predict call for all areas x 7 days
     sd = pd.to_datetime(start_date)
     results = []
 
-    for area in meta["areas"]:
-        subset = proc[proc.area == area]
-        anchor = min(proc.acq_date.max(), sd)
-        last = subset[subset.acq_date == anchor]
-        if last.empty:
-            continue
-        base = last.iloc[-1]
-
-        rows = []
-        for day in range(7):
-            d = sd + timedelta(days=day)
-            row = {}
-            for feat in meta["features"]:
-                if feat == "area_code":
-                    row["area_code"] = meta["area_map"].get(area, -1)
-                else:
-                    row[feat] = base.get(feat, 0)
-            # cyclical date features
-            doy = d.timetuple().tm_yday
-            m = d.month
-            row.update({
-                "day_of_year": doy,
-                "day_sin": np.sin(2 * np.pi * doy / 365.25),
-                "day_cos": np.cos(2 * np.pi * doy / 365.25),
-                "month": m,
-                "month_sin": np.sin(2 * np.pi * m / 12),
-                "month_cos": np.cos(2 * np.pi * m / 12),
+    areas, df_in = build_feature_matrix(meta, proc, sd)
+    if areas:
+        preds = np.asarray(model.predict(df_in)).reshape(len(areas), 7)
+        weekly_prob = 1 - np.prod(1 - preds, axis=1)
+        for area, prob in zip(areas, weekly_prob):
+            results.append({
+                "area": area,
+                "fire_risk_percent": round(prob * 100, 2)
             })
-            rows.append(row)
-
-        df_in = pd.DataFrame(rows)
-        preds = model.predict(df_in[meta["features"]])
-        weekly_prob = 1 - np.prod(1 - preds)
-        results.append({
-            "area": area,
-            "fire_risk_percent": round(weekly_prob * 100, 2)
-        })
 
     country_pct = round(np.mean([r["fire_risk_percent"] for r in results]), 2)
 
@@ -137,89 +402,1248 @@ def predict_from_package(country: str, start_date: str, package_path: str = PACK
         "predictions": sorted(results, key=lambda x: -x["fire_risk_percent"])
     }
 
+def cached_predict(country: str, start_date: str, package_path: str = PACKAGE_PATH) -> dict:
+    """
+    predict_from_package backed by the persistent prediction store.
+    A hit returns the stored result (including its original generated_at).
+    The start is normalized to its date, so every request for that day gets the
+    same prediction; results without predictions are returned but never stored.
+    """
+    key_date = pd.to_datetime(start_date).date().isoformat()
+    if not prediction_store.enabled:
+        return predict_from_package(country, key_date, package_path)
+
+    package_hash = package_fingerprint(package_path)
+    result = prediction_store.get(package_hash, country, key_date)
+    if result is None:
+        result = predict_from_package(country, key_date, package_path)
+        if result["predictions"] and not pd.isna(result["country_area_percentage"]):
+            prediction_store.put(package_hash, country, key_date, result)
+    return result
+
+
+def package_countries(package_path: str = PACKAGE_PATH):
+    """List the countries that have a model in the package."""
+    with zipfile.ZipFile(package_path, 'r') as zf:
+        return sorted(name[:-len("_meta.json")] for name in zf.namelist() if name.endswith("_meta.json"))
+
+
+# Status of the most recent pre-warm job
+prewarm_status = {"running": False, "done": 0, "total": 0, "errors": 0, "started_at": None, "finished_at": None}
+prewarm_lock = threading.Lock()
+
+
+def prewarm_predictions(weeks: int, start_date=None, package_path: str = PACKAGE_PATH):
+    """
+    Materialize weekly predictions for every country in the package,
+    starting at start_date (default: today) for the next `weeks` weeks.
+    """
+    sd = pd.to_datetime(start_date) if start_date else pd.Timestamp(datetime.now(timezone.utc).date())
+    start_dates = [(sd + timedelta(weeks=w)).date().isoformat() for w in range(weeks)]
+    countries = package_countries(package_path)
+
+    prewarm_status.update({
+        "running": True, "done": 0, "total": len(countries) * len(start_dates), "errors": 0,
+        "started_at": time.time(), "finished_at": None
+    })
+    try:
+        prediction_store.purge_except(package_fingerprint(package_path))
+        for country in countries:
+            for d in start_dates:
+                try:
+                    cached_predict(country, d, package_path)
+                except Exception as e:
+                    print(f"Pre-warm failed for {country} {d}: {e}")
+                    prewarm_status["errors"] += 1
+                prewarm_status["done"] += 1
+    finally:
+        prewarm_status["running"] = False
+        prewarm_status["finished_at"] = time.time()
+
+
+def start_prewarm(weeks: int, start_date=None, package_path: str = PACKAGE_PATH) -> bool:
+    """Start a pre-warm job in a background thread unless one is already running."""
+    with prewarm_lock:
+        if prewarm_status["running"]:
+            return False
+        prewarm_status["running"] = True
+    thread = threading.Thread(target=prewarm_predictions, args=(weeks, start_date, package_path))
+    thread.daemon = True
+    thread.start()
+    return True
+
+
+def predict_country_batch(country: str, start_dates, package_path: str = PACKAGE_PATH) -> dict:
+    """
+    Run cached_predict for one country over several start dates.
+    The package is loaded once (via the model registry) and shared by every date.
+    Per-date failures are reported inline instead of failing the whole country.
+    """
+    results = []
+    for start_date in start_dates:
+        try:
+            results.append({"start_date": start_date, "result": cached_predict(country, start_date, package_path)})
+        except Exception as e:
+            results.append({"start_date": start_date, "error": str(e)})
+    return {"country": country, "results": results}
+
+
+# Shared pool so concurrent batch requests cannot oversubscribe the CPU
+predict_executor = ThreadPoolExecutor(max_workers=max(1, PREDICT_BATCH_WORKERS), thread_name_prefix="predict")
+
+# -------------------------------
+# Function: File helpers
+# -------------------------------
+def file_version(path):
+    """Cheap change marker for derived files (indexes, cubes): mtime + size."""
+    st = os.stat(path)
+    return f"{st.st_mtime_ns}:{st.st_size}"
+
+
+def year_file_paths(folder):
+    """
+    The {year}.parquet files of a data folder, skipping the derived dot-entries
+    kept next to them (.cube, .catalog.json, .results, ...).
+    """
+    if not os.path.isdir(folder):
+        return []
+    return sorted(os.path.join(folder, name) for name in os.listdir(folder)
+                  if name.endswith(".parquet") and not name.startswith("."))
+
+
+def arrow_copy_path(year_path):
+    """data/modis/{year}.parquet -> data/modis/.arrow/{year}.arrow"""
+    name = os.path.splitext(os.path.basename(year_path))[0]
+    return os.path.join(os.path.dirname(year_path), ".arrow", f"{name}.arrow")
+
+
+def write_tagged_arrow(path, table, tags, max_chunksize=None):
+    """
+    Atomically write an uncompressed Arrow IPC file whose schema metadata
+    carries `tags` (e.g. the source file's version), for open_tagged_arrow.
+    """
+    metadata = dict(table.schema.metadata or {})
+    metadata.update({key.encode(): str(value).encode() for key, value in tags.items()})
+    table = table.replace_schema_metadata(metadata)
+
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+    with pa.OSFile(tmp_path, "wb") as sink:
+        with pa.ipc.new_file(sink, table.schema) as writer:
+            writer.write_table(table, max_chunksize=max_chunksize)
+    os.replace(tmp_path, path)
+    return path
+
+
+def open_tagged_arrow(path, tags=None):
+    """Memory-mapped table of an Arrow IPC file, or None if it is missing or a tag differs."""
+    if not os.path.exists(path):
+        return None
+    reader = pa.ipc.open_file(pa.memory_map(path, "r"))
+    metadata = reader.schema.metadata or {}
+    for key, value in (tags or {}).items():
+        if metadata.get(key.encode(), b"").decode() != str(value):
+            return None
+    return reader.read_all()
+
+
+def write_arrow_copy(year_path, table=None):
+    """
+    Write the uncompressed Arrow IPC copy of a year file, tagged with the
+    Parquet file's version so readers ignore it once the Parquet changes.
+    Pass the already-loaded table to skip re-reading the year file.
+    """
+    if table is None:
+        table = pq.read_table(year_path, memory_map=True)
+    return write_tagged_arrow(arrow_copy_path(year_path), table,
+                              {"source_version": file_version(year_path)}, CONVERT_ROW_GROUP_SIZE)
+
+
+def open_arrow_copy(year_path):
+    """Memory-mapped table of the year's Arrow copy, or None if it is missing or stale."""
+    return open_tagged_arrow(arrow_copy_path(year_path), {"source_version": file_version(year_path)})
+
+# -------------------------------
+# Class: Year table cache
+# -------------------------------
+class YearTableCache:
+    """
+    Process-wide LRU cache of decoded Arrow tables, one per Parquet file
+    (data/modis/{year}.parquet and the analysis cubes), shared by every
+    endpoint. Files are read through a memory map, entries are keyed by the
+    file's mtime/size and the cache holds at most YEAR_CACHE_MB of decoded
+    data; a file larger than the whole budget is read but not kept.
+    A year with a current Arrow IPC copy is mapped from it instead: nothing
+    is decoded and its pages live in the OS page cache, outside the budget.
+    Tables are immutable, so all callers share the same buffers without copies.
+    """
+
+    def __init__(self, memory_mb=YEAR_CACHE_MB):
+        self.memory_budget = int(memory_mb * 1024 * 1024)
+        self._entries = OrderedDict()
+        self._memory_bytes = 0
+        self._lock = threading.Lock()
+        self._loading = {}  # path -> lock, so concurrent misses decode a file once
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def get(self, path, decode=True):
+        """
+        Return the whole table of a Parquet file, decoding it on a miss.
+        With decode=False only a cached or mapped table is returned, and None
+        when the file would have to be decoded; callers then read just the
+        columns and rows they need from Parquet instead.
+        """
+        path = os.path.abspath(path)
+        version = file_version(path)
+
+        with self._lock:
+            entry = self._entries.get(path)
+            if entry is not None:
+                if entry["version"] == version:
+                    self._entries.move_to_end(path)
+                    self.hits += 1
+                    return entry["table"]
+                # File was replaced on disk
+                del self._entries[path]
+                self._memory_bytes -= entry["nbytes"]
+                self.invalidations += 1
+            loading = self._loading.setdefault(path, threading.Lock())
+
+        with loading:
+            with self._lock:
+                entry = self._entries.get(path)
+                if entry is not None and entry["version"] == version:
+                    self.hits += 1
+                    return entry["table"]
+                self.misses += 1
+
+            # Decode outside the cache lock so other years are served meanwhile
+            table = open_arrow_copy(path)
+            mapped = table is not None
+            if not mapped:
+                if not decode:
+                    with self._lock:
+                        self._loading.pop(path, None)
+                    return None
+                table = pq.read_table(path, memory_map=True)
+            nbytes = 0 if mapped else table.nbytes
+
+            with self._lock:
+                self._loading.pop(path, None)
+                if nbytes <= self.memory_budget:
+                    self._entries[path] = {"version": version, "table": table, "nbytes": nbytes, "mapped": mapped}
+                    self._memory_bytes += nbytes
+                    while self._memory_bytes > self.memory_budget:
+                        _, evicted = self._entries.popitem(last=False)
+                        self._memory_bytes -= evicted["nbytes"]
+                        self.evictions += 1
+            return table
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._memory_bytes = 0
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "size": len(self._entries),
+                "memory_mb": round(self._memory_bytes / (1024 * 1024), 2),
+                "memory_budget_mb": round(self.memory_budget / (1024 * 1024), 2),
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "invalidations": self.invalidations,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+                "files": [os.path.relpath(p) for p in self._entries],
+                "mapped": [os.path.relpath(p) for p, e in self._entries.items() if e["mapped"]],
+            }
+
+
+year_tables = YearTableCache()
+
 # -------------------------------
 # Function: Conversion generator
 # -------------------------------
-def split_parquet_by_year_stream(parquet_file_path, output_base):
+def write_country_sorted_parquet(table, out_path, row_group_size=CONVERT_ROW_GROUP_SIZE):
     """
-    Reads the entire Parquet file into a single DataFrame, groups by 'year',
-    and writes each subset to a separate {year}.parquet.
-    Yields SSE-style messages to track progress.
+    Writes one year's rows sorted by (country, acq_date), with row groups that
+    never span two countries. Row-group statistics let country filters skip
+    every other country's bytes.
     """
-    os.makedirs(output_base, exist_ok=True)
+    sort_keys = [(c, 'ascending') for c in ('country', 'acq_date') if c in table.column_names]
+    table = table.sort_by(sort_keys)  # stable, nulls last
 
-    # Start reading
-    yield f"data: {json.dumps({'progress': 0, 'phase': 'reading', 'message': f'Start reading {parquet_file_path}'})}\n\n"
+    # Compare neighbours in Arrow rather than as a numpy array of Python strings
+    countries = table.column('country').fill_null('')
+    changed = pc.not_equal(countries.slice(1), countries.slice(0, len(countries) - 1))
+    boundaries = np.flatnonzero(changed.to_numpy(zero_copy_only=False)) + 1
+    starts = np.concatenate(([0], boundaries))
+    ends = np.concatenate((boundaries, [len(countries)]))
 
-    df = pd.read_parquet(parquet_file_path)
+    with pq.ParquetWriter(out_path, table.schema, compression="snappy", write_statistics=True) as writer:
+        for start, end in zip(starts, ends):
+            writer.write_table(table.slice(start, end - start), row_group_size=row_group_size)
+    return table
 
-    yield f"data: {json.dumps({'progress': None, 'phase': 'reading', 'message': 'Finished reading Parquet into DataFrame'})}\n\n"
 
-    # Group by 'year' column
-    years = df['year'].unique()
-    total_years = len(years)
-    yield f"data: {json.dumps({'progress': 0, 'phase': 'grouping', 'message': f'Found {total_years} unique years'})}\n\n"
+def convert_year_worker(source_path, out_path, layout, row_groups=None, remove_source=False, arrow_copy=False):
+    """
+    Writes one {year}.parquet from either selected row groups of the input
+    (already-partitioned data) or a whole per-year staging file, plus its
+    Arrow IPC copy when arrow_copy is set.
+    Top-level so it can run in a worker process; returns (out_path, rows).
+    """
+    pf = pq.ParquetFile(source_path)
+    table = pf.read_row_groups(row_groups) if row_groups is not None else pf.read()
 
-    # Iterate over each unique year and write the subset
-    for i, year_val in enumerate(sorted(years)):
-        cpu_usage = psutil.cpu_percent(interval=0.1)
-        if cpu_usage > CPU_THRESHOLD:
-            yield f"data: {json.dumps({'progress': None, 'phase': 'throttling', 'message': f'High CPU usage: {cpu_usage}%, sleeping 0.5 sec'})}\n\n"
-            time.sleep(0.5)
+    tmp_path = f"{out_path}.tmp"
+    if layout == "country":
+        table = write_country_sorted_parquet(table, tmp_path)
+    else:
+        pq.write_table(table, tmp_path, compression="snappy", row_group_size=CONVERT_ROW_GROUP_SIZE)
+    os.replace(tmp_path, out_path)
+    build_analysis_cube(out_path, table)
+    if arrow_copy:
+        write_arrow_copy(out_path, table)
+
+    if remove_source:
+        os.remove(source_path)
+    rows = table.num_rows
+    del table
+    # Return the year's buffers to the OS before the next year (pool workers are reused)
+    pa.default_memory_pool().release_unused()
+    return out_path, rows
 
-        # Filter rows for this year
-        group_df = df[df['year'] == year_val]
 
-        # Convert to PyArrow Table
-        table = pa.Table.from_pandas(group_df)
+def remove_year_outputs(out_path):
+    """Delete a year file and what conversion derives from it (temp file, cube, Arrow copy)."""
+    for path in (out_path, f"{out_path}.tmp", analysis_cube_path(out_path), arrow_copy_path(out_path)):
+        if os.path.isfile(path):
+            os.remove(path)
 
-        out_file = f"{year_val}.parquet"
-        out_path = os.path.join(output_base, out_file)
 
-        # Write each subset to its own Parquet
-        pq.write_table(table, out_path, compression="snappy")
+def convert_worker_cap(year_bytes, workers, budget_bytes):
+    """
+    How many years to convert at once so that the years in flight fit the
+    memory budget. Every worker holds one whole year (read, sorted, written),
+    so a budget smaller than the largest year still converts one at a time.
+    year_bytes maps year -> decoded (Arrow) size.
+    """
+    largest = max(year_bytes.values(), default=0) * CONVERT_YEAR_MEMORY_FACTOR
+    if not largest:
+        return max(1, workers)
+    return max(1, min(workers, int(budget_bytes // largest)))
 
-        # SSE progress update
-        progress_percent = int((i + 1) / total_years * 100)
-        yield f"data: {json.dumps({'progress': progress_percent, 'phase': 'splitting', 'message': f'Wrote {out_path}'})}\n\n"
 
-        mem_usage_gb = psutil.virtual_memory().used / (1024 ** 3)
-        if mem_usage_gb > MEMORY_THRESHOLD_GB:
-            yield f"data: {json.dumps({'progress': progress_percent, 'phase': 'throttling', 'message': f'High memory usage: {mem_usage_gb:.2f}GB, sleeping 1 sec'})}\n\n"
-            time.sleep(1)
+def year_row_groups(pf):
+    """
+    Map year -> row group indices when every row group holds a single year
+    (according to its statistics); None if the file is not partitioned that way.
+    """
+    if 'year' not in pf.schema_arrow.names:
+        return None
+    year_idx = pf.schema_arrow.names.index('year')
+    partitions = {}
+    for i in range(pf.metadata.num_row_groups):
+        stats = pf.metadata.row_group(i).column(year_idx).statistics
+        if stats is None or not stats.has_min_max or stats.min != stats.max or stats.null_count:
+            return None
+        partitions.setdefault(stats.min, []).append(i)
+    return partitions
+
+
+def run_year_tasks(tasks, workers, start_progress, end_progress):
+    """
+    Runs convert_year_worker for each {year: kwargs} task, in-process when
+    workers <= 1 and otherwise on a process pool capped at `workers`.
+    Yields SSE progress as each year finishes. Stops at the first failing
+    year with an error message; returns whether every year was written.
+    """
+    total = len(tasks)
+    if total == 0:
+        return True
+
+    def progress_msg(done, out_path, rows):
+        progress_percent = start_progress + int(done / total * (end_progress - start_progress))
+        return f"data: {json.dumps({'progress': progress_percent, 'phase': 'splitting', 'message': f'Wrote {out_path} ({rows} rows)'})}\n\n"
+
+    def error_msg(year_val, e):
+        return f"data: {json.dumps({'progress': None, 'phase': 'error', 'message': f'Conversion error for year {year_val}: {e}'})}\n\n"
+
+    if workers <= 1 or total == 1:
+        for done, year_val in enumerate(sorted(tasks), start=1):
+            try:
+                out_path, rows = convert_year_worker(**tasks[year_val])
+            except Exception as e:
+                yield error_msg(year_val, e)
+                return False
+            yield progress_msg(done, out_path, rows)
+        return True
+
+    # spawn: forking a threaded Flask process is not safe
+    ctx = multiprocessing.get_context("spawn")
+    with ProcessPoolExecutor(max_workers=min(workers, total), mp_context=ctx) as pool:
+        futures = {pool.submit(convert_year_worker, **kwargs): year_val for year_val, kwargs in tasks.items()}
+        for done, future in enumerate(as_completed(futures), start=1):
+            try:
+                out_path, rows = future.result()
+            except Exception as e:
+                # Leaving the pool waits for the years still running, so the
+                # caller can clean up once we return
+                for f in futures:
+                    f.cancel()
+                yield error_msg(futures[future], e)
+                return False
+            yield progress_msg(done, out_path, rows)
+    return True
+
+
+def split_parquet_by_year_stream(parquet_file_path, output_base, layout=CONVERT_LAYOUT,
+                                 memory_budget_mb=CONVERT_MEMORY_BUDGET_MB, workers=CONVERT_WORKERS,
+                                 arrow_copy=CONVERT_ARROW_COPY):
+    """
+    Streams the Parquet file in record batches and appends each batch's rows to a
+    per-year ParquetWriter, writing each subset to a separate {year}.parquet.
+    Rows are buffered per year and the largest buffer is flushed whenever the total
+    exceeds memory_budget_mb, so memory stays bounded regardless of input size.
+    With layout="country" each year is then re-read on its own and rewritten sorted
+    by country/date (see write_country_sorted_parquet).
+    Every year also gets its analysis cube (see build_analysis_cube).
+    If the input's row groups are already partitioned by year, the split pass is
+    skipped and each year is written straight from its row groups.
+    Per-year writes fan out over up to `workers` processes; each worker holds one
+    year in memory at a time, so fewer run at once when the largest year would
+    not fit memory_budget_mb that many times (see convert_worker_cap).
+    If any step fails (or the stream is closed early), the staging files and every
+    year written so far are removed again and no 'done' message is sent, so a
+    partial conversion is never taken for a complete data folder.
+    Yields SSE-style messages to track progress.
+    """
+    os.makedirs(output_base, exist_ok=True)
+    budget_bytes = int(memory_budget_mb * 1024 ** 2)
+
+    staging = {}
+    out_paths = []  # year files this run writes
+    completed = False
+    try:
+        # Start reading
+        yield f"data: {json.dumps({'progress': 0, 'phase': 'reading', 'message': f'Start reading {parquet_file_path}'})}\n\n"
+
+        pf = pq.ParquetFile(parquet_file_path)
+        # Decoded (Arrow) size per row, sampled from the first rows; the Parquet
+        # metadata only has encoded sizes, which dictionary encoding shrinks many times
+        sample = next(pf.iter_batches(batch_size=4096), None)
+        bytes_per_row = max(1, sample.nbytes // max(1, sample.num_rows)) if sample is not None else 1
+
+        partitions = year_row_groups(pf)
+        if partitions:
+            year_bytes = {
+                year_val: bytes_per_row * sum(pf.metadata.row_group(i).num_rows for i in row_groups)
+                for year_val, row_groups in partitions.items()
+            }
+            workers = convert_worker_cap(year_bytes, workers, budget_bytes)
+            yield f"data: {json.dumps({'progress': 0, 'phase': 'grouping', 'message': f'Found {len(partitions)} unique years (already partitioned), using {workers} workers'})}\n\n"
+            tasks = {
+                year_val: {
+                    "source_path": parquet_file_path,
+                    "out_path": os.path.join(output_base, f"{year_val}.parquet"),
+                    "layout": layout,
+                    "row_groups": row_groups,
+                    "arrow_copy": arrow_copy,
+                }
+                for year_val, row_groups in partitions.items()
+            }
+            out_paths = [task["out_path"] for task in tasks.values()]
+            if not (yield from run_year_tasks(tasks, workers, 0, 100)):
+                return
+        else:
+            total_rows = pf.metadata.num_rows
+            # Keep a single decoded batch to a fraction of the budget
+            batch_rows = int(min(1_000_000, max(1024, budget_bytes // 8 // bytes_per_row)))
+
+            # Splitting takes most of the work; the country sort pass gets the remainder
+            split_share = 100 if layout == "plain" else 70
+
+            writers = {}
+            buffers = {}
+            buffered_bytes = {}
+            year_bytes = {}  # decoded size of each year, for convert_worker_cap
+
+            def flush(year_val):
+                table = pa.Table.from_batches(buffers.pop(year_val))
+                buffered_bytes.pop(year_val)
+                if year_val not in writers:
+                    staging[year_val] = os.path.join(output_base, f".{year_val}.parquet.staging")
+                    out_paths.append(os.path.join(output_base, f"{year_val}.parquet"))
+                    writers[year_val] = pq.ParquetWriter(staging[year_val], table.schema, compression="snappy")
+                writers[year_val].write_table(table, row_group_size=CONVERT_ROW_GROUP_SIZE)
+
+            rows_done = 0
+            last_progress = -1
+            try:
+                for batch in pf.iter_batches(batch_size=batch_rows):
+                    years_col = batch.column(batch.schema.get_field_index('year'))
+                    for year_val in pc.unique(years_col).drop_null().to_pylist():
+                        part = batch.filter(pc.equal(years_col, year_val))
+                        buffers.setdefault(year_val, []).append(part)
+                        buffered_bytes[year_val] = buffered_bytes.get(year_val, 0) + part.nbytes
+                        year_bytes[year_val] = year_bytes.get(year_val, 0) + part.nbytes
+
+                    # Flush the largest per-year buffers until we are back under budget
+                    while buffered_bytes and sum(buffered_bytes.values()) > budget_bytes:
+                        flush(max(buffered_bytes, key=buffered_bytes.get))
+
+                    rows_done += batch.num_rows
+                    progress_percent = int(rows_done / max(1, total_rows) * split_share)
+                    if progress_percent != last_progress:
+                        last_progress = progress_percent
+                        yield f"data: {json.dumps({'progress': progress_percent, 'phase': 'splitting', 'message': f'Read {rows_done}/{total_rows} rows'})}\n\n"
+
+                for year_val in list(buffers):
+                    flush(year_val)
+            finally:
+                for writer in writers.values():
+                    writer.close()
+            # Hand the split buffers back to the OS before the per-year pass
+            pa.default_memory_pool().release_unused()
+
+            yield f"data: {json.dumps({'progress': split_share, 'phase': 'grouping', 'message': f'Found {len(staging)} unique years'})}\n\n"
+
+            if layout == "country":
+                workers = convert_worker_cap(year_bytes, workers, budget_bytes)
+                tasks = {
+                    year_val: {
+                        "source_path": staging_path,
+                        "out_path": os.path.join(output_base, f"{year_val}.parquet"),
+                        "layout": layout,
+                        "remove_source": True,
+                        "arrow_copy": arrow_copy,
+                    }
+                    for year_val, staging_path in staging.items()
+                }
+                if not (yield from run_year_tasks(tasks, workers, split_share, 100)):
+                    return
+            else:
+                for year_val, staging_path in sorted(staging.items()):
+                    out_path = os.path.join(output_base, f"{year_val}.parquet")
+                    os.replace(staging_path, out_path)
+                    build_analysis_cube(out_path)
+                    if arrow_copy:
+                        write_arrow_copy(out_path)
+                    yield f"data: {json.dumps({'progress': 100, 'phase': 'splitting', 'message': f'Wrote {out_path}'})}\n\n"
+
+        # Record the new year files in the folder's catalog
+        catalog_for(output_base).sync(force=True)
+        completed = True
+    except Exception as e:
+        print(f"Conversion of {parquet_file_path} failed: {e}")
+        yield f"data: {json.dumps({'progress': None, 'phase': 'error', 'message': f'Conversion error: {e}'})}\n\n"
+        return
+    finally:
+        if not completed:
+            for path in staging.values():
+                if os.path.exists(path):
+                    os.remove(path)
+            for out_path in out_paths:
+                remove_year_outputs(out_path)
 
     # Done
     yield f"data: {json.dumps({'progress': 100, 'phase': 'done', 'message': 'Split by year complete'})}\n\n"
 
 
+# ------------------------------
+# Class: Detail lookup index
+# ------------------------------
+DETAIL_COLUMNS = ['latitude', 'longitude', 'acq_date', 'acq_time', 'daynight', 'country', 'type', 'brightness', 'area']
+
+
+class YearArrowIndex:
+    """
+    Base of the per-year lookup indexes: one memory-mapped Arrow IPC file per
+    data/modis/{year}.parquet in index_dir, tagged with the source file's
+    version and rebuilt when it changes. Subclasses build the sorted table
+    (_index_table) and the in-memory entry looked up by queries (_entry).
+    A cold year is built under its own lock, so other years are served meanwhile.
+    """
+
+    def __init__(self, data_folder, index_dir):
+        self.data_folder = data_folder
+        self.index_dir = index_dir
+        self._indexes = {}
+        self._lock = threading.Lock()
+        self._loading = {}  # year -> lock, so concurrent misses build a year once
+
+    def _index_path(self, year):
+        return os.path.join(self.index_dir, f"{year}.arrow")
+
+    def _tags(self, version):
+        return {"source_version": version}
+
+    def _index_table(self, table):
+        raise NotImplementedError
+
+    def _entry(self, version, table):
+        raise NotImplementedError
+
+    def build(self, year):
+        """(Re)build the index file for one year and return its path."""
+        parquet_path = os.path.join(self.data_folder, f"{year}.parquet")
+        version = file_version(parquet_path)
+        table = self._index_table(year_tables.get(parquet_path)).combine_chunks()
+        return write_tagged_arrow(self._index_path(year), table, self._tags(version), max(1, table.num_rows))
+
+    def _open(self, year):
+        year = str(year)
+        parquet_path = os.path.join(self.data_folder, f"{year}.parquet")
+        version = file_version(parquet_path)
+
+        with self._lock:
+            entry = self._indexes.get(year)
+            if entry is not None and entry["version"] == version:
+                return entry
+            loading = self._loading.setdefault(year, threading.Lock())
+
+        with loading:
+            with self._lock:
+                entry = self._indexes.get(year)
+                if entry is not None and entry["version"] == version:
+                    return entry
+
+            # Map (or build) outside the shared lock so other years are served meanwhile
+            table = open_tagged_arrow(self._index_path(year), self._tags(version))
+            if table is None:
+                table = open_tagged_arrow(self.build(year))
+            entry = self._entry(version, table)
+
+            with self._lock:
+                self._loading.pop(year, None)
+                self._indexes[year] = entry
+            return entry
+
+
+class DetailIndex(YearArrowIndex):
+    """
+    Per-year point lookup index for /api/detail.
+    For each data/modis/{year}.parquet we write an uncompressed Arrow IPC file
+    holding the detail columns sorted by a 64-bit hash of (latitude, longitude).
+    The file is memory-mapped, so a lookup is a binary search over the key column
+    and a check of country/acq_date/acq_time on the few rows sharing that point.
+    The index is rebuilt when the source Parquet file's mtime/size change.
+    """
+
+    KEY_COLUMN = "_key"
+
+    def __init__(self, data_folder=DATA_FOLDER, index_dir=DETAIL_INDEX_DIR):
+        super().__init__(data_folder, index_dir)
+
+    @staticmethod
+    def _hash_keys(latitude, longitude):
+        """Mix the float64 bit patterns of latitude/longitude into one uint64 key."""
+        lat_bits = np.ascontiguousarray(latitude, dtype=np.float64).view(np.uint64)
+        lon_bits = np.ascontiguousarray(longitude, dtype=np.float64).view(np.uint64)
+        h = lat_bits ^ (lon_bits * np.uint64(0x9E3779B97F4A7C15))
+        h ^= h >> np.uint64(31)
+        h *= np.uint64(0xBF58476D1CE4E5B9)
+        h ^= h >> np.uint64(27)
+        return h
+
+    def _index_table(self, table):
+        table = table.select([c for c in DETAIL_COLUMNS if c in table.column_names])
+        keys = self._hash_keys(
+            table.column('latitude').to_numpy().astype(np.float64),
+            table.column('longitude').to_numpy().astype(np.float64)
+        )
+        order = np.argsort(keys, kind="stable")
+        return table.take(pa.array(order)).append_column(self.KEY_COLUMN, pa.array(keys[order], type=pa.uint64()))
+
+    def _entry(self, version, table):
+        key_column = table.column(self.KEY_COLUMN)
+        return {
+            "version": version,
+            "table": table.drop_columns([self.KEY_COLUMN]),
+            "keys": key_column.chunk(0).to_numpy() if key_column.num_chunks == 1 else key_column.to_numpy(),
+            "float32": {c: pa.types.is_float32(table.schema.field(c).type) for c in ('latitude', 'longitude')},
+        }
+
+    def lookup(self, year, country, lat_str, lon_str, acq_date, acq_time_str):
+        """Return the list of records matching the clicked point (usually one)."""
+        entry = self._open(year)
+
+        # Round-trip the query through the stored float width so float32 files match
+        lat, lon = float(lat_str), float(lon_str)
+        if entry["float32"]["latitude"]:
+            lat = float(np.float32(lat))
+        if entry["float32"]["longitude"]:
+            lon = float(np.float32(lon))
+
+        key = self._hash_keys([lat], [lon])[0]
+        lo = np.searchsorted(entry["keys"], key, side="left")
+        hi = np.searchsorted(entry["keys"], key, side="right")
+
+        # Exact comparison on the few rows that share this point (also guards against collisions)
+        return [
+            row for row in entry["table"].slice(lo, hi - lo).to_pylist()
+            if row['latitude'] == lat and row['longitude'] == lon
+            and str(row['country']) == str(country)
+            and str(row['acq_date']) == str(acq_date)
+            and str(row['acq_time']) == str(acq_time_str)
+        ]
+
+
+detail_index = DetailIndex()
+
+
+# ------------------------------
+# Class: Viewport tile index
+# ------------------------------
+MAP_COLUMNS = ['latitude', 'longitude', 'brightness', 'acq_date', 'acq_time', 'daynight', 'type', 'country']
+
+
+class TileIndex(YearArrowIndex):
+    """
+    Per-year spatial index for viewport queries on the map.
+    For each data/modis/{year}.parquet we write an uncompressed Arrow IPC file
+    of the map columns sorted by a TILE_GRID_DEG lat/lon grid cell
+    (row * columns + col). A bounding box becomes one key range per grid row,
+    found by binary search on the memory-mapped key column, so a query only
+    touches the cells it covers. Rebuilt when the source file's mtime/size change.
+    """
+
+    KEY_COLUMN = "_cell"
+
+    def __init__(self, data_folder=DATA_FOLDER, index_dir=TILE_INDEX_DIR, grid_deg=TILE_GRID_DEG):
+        super().__init__(data_folder, index_dir)
+        self.grid_deg = grid_deg
+        self.grid_columns = int(np.ceil(360 / grid_deg))
+
+    def _cells(self, latitude, longitude):
+        rows = np.floor((np.asarray(latitude, dtype=np.float64) + 90) / self.grid_deg).astype(np.int64)
+        cols = np.floor((np.asarray(longitude, dtype=np.float64) + 180) / self.grid_deg).astype(np.int64)
+        return rows, np.clip(cols, 0, self.grid_columns - 1)
+
+    def _tags(self, version):
+        # A different grid size needs a rebuild too
+        return {"source_version": version, "grid_deg": self.grid_deg}
+
+    def _index_table(self, table):
+        table = table.select([c for c in MAP_COLUMNS if c in table.column_names])
+        rows, cols = self._cells(table.column('latitude').to_numpy(), table.column('longitude').to_numpy())
+        keys = rows * self.grid_columns + cols
+        order = np.argsort(keys, kind="stable")
+        return table.take(pa.array(order)).append_column(self.KEY_COLUMN, pa.array(keys[order], type=pa.int64()))
+
+    def _entry(self, version, table):
+        return {
+            "version": version,
+            "table": table.drop_columns([self.KEY_COLUMN]),
+            "keys": table.column(self.KEY_COLUMN).to_numpy(),
+            "latitude": table.column('latitude').to_numpy(),
+            "longitude": table.column('longitude').to_numpy(),
+        }
+
+    def _bbox_rows(self, entry, west, south, east, north):
+        """Index positions of the points inside one non-wrapping bounding box."""
+        (row_lo, row_hi), (col_lo, col_hi) = self._cells([south, north], [west, east])
+        grid_rows = np.arange(row_lo, row_hi + 1, dtype=np.int64) * self.grid_columns
+        starts = np.searchsorted(entry["keys"], grid_rows + col_lo, side="left")
+        ends = np.searchsorted(entry["keys"], grid_rows + col_hi, side="right")
+        spans = [np.arange(a, b) for a, b in zip(starts, ends) if b > a]
+        if not spans:
+            return np.empty(0, dtype=np.int64)
+        positions = np.concatenate(spans)
+        # Cells on the box edge stick out of it: keep only the points really inside
+        lat, lon = entry["latitude"][positions], entry["longitude"][positions]
+        return positions[(lat >= south) & (lat <= north) & (lon >= west) & (lon <= east)]
+
+    def query(self, year, west, south, east, north, zoom, country=None):
+        """
+        Map points of one year inside the bounding box, with a `count` column.
+        Below TILE_FULL_ZOOM the points are clustered on a grid of about
+        TILE_CLUSTER_PX screen pixels: each cluster is sent as its brightest
+        fire, carrying the number of fires it stands for.
+        """
+        entry = self._open(year)
+        if west <= east:
+            positions = self._bbox_rows(entry, west, south, east, north)
+        else:
+            # The box crosses the antimeridian
+            positions = np.concatenate([
+                self._bbox_rows(entry, west, south, 180.0, north),
+                self._bbox_rows(entry, -180.0, south, east, north),
+            ])
+        table = entry["table"].take(pa.array(positions, type=pa.int64()))
+        if country:
+            table = table.filter(pc.equal(table.column('country'), country))
+
+        if zoom >= TILE_FULL_ZOOM or table.num_rows == 0:
+            return table.append_column('count', pa.array(np.ones(table.num_rows, dtype=np.int64)))
+
+        cluster_deg = TILE_CLUSTER_PX * 360.0 / (256 * 2 ** max(zoom, 0))
+        lat = table.column('latitude').to_numpy()
+        lon = table.column('longitude').to_numpy()
+        clusters = (np.floor((lat + 90) / cluster_deg).astype(np.int64) * int(np.ceil(360 / cluster_deg) + 1)
+                    + np.floor((lon + 180) / cluster_deg).astype(np.int64))
+        # Brightest fire first within each cluster, then one row per cluster
+        order = np.lexsort((-table.column('brightness').to_numpy(), clusters))
+        _, first, counts = np.unique(clusters[order], return_index=True, return_counts=True)
+        representatives = order[first]
+        return table.take(pa.array(representatives)).append_column('count', pa.array(counts.astype(np.int64)))
+
+
+tile_index = TileIndex()
+
+
 # ------------------------------
 # Analysis Functions
 # ------------------------------
+class AnalysisCancelled(Exception):
+    """Raised inside an analysis job when its session has been asked to stop."""
+
+
+class SharedJobState:
+    """
+    Analysis job state shared by every worker process through one SQLite file:
+    each session's progress state (with a version number bumped on every
+    update), stop requests for jobs running in another process, and finished
+    results as gzipped JSON. Disabled when SHARED_STATE_DB is empty.
+    """
+
+    def __init__(self, db_path=SHARED_STATE_DB):
+        self.db_path = db_path
+        if self.enabled:
+            os.makedirs(os.path.dirname(os.path.abspath(db_path)), exist_ok=True)
+            with self._connect() as conn:
+                conn.execute("""
+                    CREATE TABLE IF NOT EXISTS progress (
+                        session_id TEXT PRIMARY KEY,
+                        version INTEGER NOT NULL,
+                        state TEXT NOT NULL,
+                        updated_at REAL NOT NULL
+                    )
+                """)
+                conn.execute("""
+                    CREATE TABLE IF NOT EXISTS cancels (
+                        session_id TEXT PRIMARY KEY,
+                        requested_at REAL NOT NULL
+                    )
+                """)
+                conn.execute("""
+                    CREATE TABLE IF NOT EXISTS results (
+                        session_id TEXT PRIMARY KEY,
+                        body BLOB NOT NULL,
+                        stored_at REAL NOT NULL
+                    )
+                """)
+
+    @property
+    def enabled(self):
+        return bool(self.db_path)
+
+    @contextmanager
+    def _connect(self):
+        conn = sqlite3.connect(self.db_path, timeout=30)
+        try:
+            conn.execute("PRAGMA journal_mode=WAL")
+            # Progress is transient: skip the fsync on every update
+            conn.execute("PRAGMA synchronous=NORMAL")
+            with conn:
+                yield conn
+        finally:
+            conn.close()
+
+    def publish(self, session_id, fields):
+        """Merge fields into a session's state; returns the new (version, state)."""
+        with self._connect() as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            row = conn.execute(
+                "SELECT version, state FROM progress WHERE session_id = ?", (session_id,)
+            ).fetchone()
+            version, state = (row[0], json.loads(row[1])) if row else (0, {"value": 0})
+            state.update(fields)
+            conn.execute(
+                "INSERT OR REPLACE INTO progress VALUES (?, ?, ?, ?)",
+                (session_id, version + 1, json.dumps(state), state["last_update"])
+            )
+        return version + 1, state
+
+    def load(self, session_id):
+        """(version, state) of a session, or None if it is unknown."""
+        with self._connect() as conn:
+            row = conn.execute(
+                "SELECT version, state FROM progress WHERE session_id = ?", (session_id,)
+            ).fetchone()
+        return (row[0], json.loads(row[1])) if row else None
+
+    def discard(self, session_id):
+        with self._connect() as conn:
+            conn.execute("DELETE FROM progress WHERE session_id = ?", (session_id,))
+
+    def request_cancel(self, session_id):
+        """Record a stop request; returns whether the session is known to any process."""
+        with self._connect() as conn:
+            conn.execute("INSERT OR REPLACE INTO cancels VALUES (?, ?)", (session_id, time.time()))
+            return conn.execute(
+                "SELECT 1 FROM progress WHERE session_id = ?", (session_id,)
+            ).fetchone() is not None
+
+    def cancel_requested(self, session_id):
+        with self._connect() as conn:
+            return conn.execute(
+                "SELECT 1 FROM cancels WHERE session_id = ?", (session_id,)
+            ).fetchone() is not None
+
+    def put_result(self, session_id, body, stored_at):
+        with self._connect() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO results VALUES (?, ?, ?)",
+                (session_id, gzip.compress(body, compresslevel=5), stored_at)
+            )
+
+    def get_result(self, session_id, stored_after):
+        """JSON bytes of a session's results stored after the given time, or None."""
+        with self._connect() as conn:
+            row = conn.execute(
+                "SELECT body FROM results WHERE session_id = ? AND stored_at >= ?", (session_id, stored_after)
+            ).fetchone()
+        return gzip.decompress(row[0]) if row else None
+
+    def purge(self, cutoff):
+        """Drop progress, stop requests and results last touched before cutoff."""
+        with self._connect() as conn:
+            return sum(
+                conn.execute(f"DELETE FROM {table} WHERE {column} < ?", (cutoff,)).rowcount
+                for table, column in (("progress", "updated_at"), ("cancels", "requested_at"),
+                                      ("results", "stored_at"))
+            )
+
+    def stats(self):
+        info = {"enabled": self.enabled}
+        if self.enabled:
+            with self._connect() as conn:
+                for table in ("progress", "cancels", "results"):
+                    info[table] = conn.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0]
+        return info
+
+
+job_state = SharedJobState()
+
+
+class CancelToken(threading.Event):
+    """
+    A job's stop flag. With shared job state it also picks up stop requests
+    made through another worker process, checking at most every SHARED_STATE_POLL seconds.
+    """
+
+    def __init__(self, session_id, store=None):
+        super().__init__()
+        self.session_id = session_id
+        self._store = store
+        self._checked = 0.0
+
+    def is_set(self):
+        if not super().is_set() and self._store is not None:
+            now = time.monotonic()
+            if now - self._checked >= SHARED_STATE_POLL:
+                self._checked = now
+                if self._store.cancel_requested(self.session_id):
+                    self.set()
+        return super().is_set()
+
+
+class ProgressBus:
+    """
+    Latest-value pub/sub for progress streams. Publishers merge fields into a
+    topic's state and wake only that topic's subscribers; a subscriber sleeps
+    on the topic's condition until the state changes or the heartbeat is due.
+    Event-loop subscribers use wait_async(), which suspends a coroutine instead.
+    With a shared store, states and versions live in it and the local dict is a
+    mirror: subscribers also re-read the store every `poll` seconds to see
+    updates published by other worker processes.
+    """
+
+    def __init__(self, states=None, store=None, poll=SHARED_STATE_POLL):
+        self._lock = threading.Lock()
+        self._states = {} if states is None else states
+        self._versions = {}
+        self._conditions = {}
+        self._watchers = {}  # topic -> callbacks waking asyncio subscribers
+        self._store = store
+        self._poll = poll
+
+    def _notify(self, topic, condition):
+        if condition is not None:
+            condition.notify_all()
+        for wake in self._watchers.get(topic, ()):
+            wake()
+
+    def _adopt(self, topic, version, state):
+        """Take a newer (version, state) from the store; caller holds the lock."""
+        if version > self._versions.get(topic, 0):
+            self._states[topic] = state
+            self._versions[topic] = version
+            self._notify(topic, self._conditions.get(topic))
+
+    def _refresh(self, topic):
+        """Mirror the store's state of a topic (no-op without a store)."""
+        if self._store is None:
+            return
+        with self._lock:
+            known = self._versions.get(topic, 0)
+        row = self._store.load(topic)
+        with self._lock:
+            if self._versions.get(topic, 0) != known:
+                return  # Published here meanwhile; the next refresh will catch up
+            if row is not None:
+                self._adopt(topic, *row)
+            elif known:
+                # Discarded by another process
+                self._states.pop(topic, None)
+                self._versions.pop(topic, None)
+                self._notify(topic, self._conditions.get(topic))
+
+    def publish(self, topic, **fields):
+        fields["last_update"] = time.time()
+        if self._store is not None:
+            version, state = self._store.publish(topic, fields)
+            with self._lock:
+                self._adopt(topic, version, state)
+            return
+        with self._lock:
+            state = self._states.setdefault(topic, {"value": 0})
+            state.update(fields)
+            self._versions[topic] = self._versions.get(topic, 0) + 1
+            self._notify(topic, self._conditions.get(topic))
+
+    def subscribe(self, topic):
+        """Current (version, state) of a topic, creating it at 0% if unknown."""
+        self._refresh(topic)
+        with self._lock:
+            state = self._states.setdefault(topic, {"value": 0, "last_update": time.time()})
+            return self._versions.get(topic, 0), dict(state)
+
+    def _changed(self, topic, version):
+        return self._versions.get(topic, 0) != version
+
+    def wait(self, topic, version, timeout):
+        """
+        Block until the topic moves past `version` or `timeout` seconds pass.
+        Returns (version, state copy); the version is unchanged on timeout and
+        the state is None once the topic has been discarded.
+        """
+        deadline = time.monotonic() + timeout
+        while True:
+            self._refresh(topic)
+            with self._lock:
+                condition = self._conditions.get(topic)
+                if condition is None:
+                    condition = self._conditions[topic] = threading.Condition(self._lock)
+                remaining = deadline - time.monotonic()
+                if self._store is not None:
+                    remaining = min(remaining, self._poll)
+                changed = condition.wait_for(lambda: self._changed(topic, version), max(0, remaining))
+                if changed or time.monotonic() >= deadline:
+                    return self._snapshot(topic)
+
+    async def wait_async(self, topic, version, timeout):
+        """wait() for coroutines: publishers wake the event loop thread-safely."""
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + timeout
+        while True:
+            if self._store is not None:
+                await asyncio.to_thread(self._refresh, topic)
+            woken = asyncio.Event()
+
+            def wake():
+                loop.call_soon_threadsafe(woken.set)
+
+            with self._lock:
+                if self._changed(topic, version):
+                    return self._snapshot(topic)
+                self._watchers.setdefault(topic, set()).add(wake)
+            remaining = deadline - loop.time()
+            if self._store is not None:
+                remaining = min(remaining, self._poll)
+            try:
+                await asyncio.wait_for(woken.wait(), max(0, remaining))
+            except asyncio.TimeoutError:
+                pass
+            finally:
+                with self._lock:
+                    watchers = self._watchers.get(topic)
+                    if watchers is not None:
+                        watchers.discard(wake)
+                        if not watchers:
+                            del self._watchers[topic]
+            with self._lock:
+                if self._changed(topic, version) or loop.time() >= deadline:
+                    return self._snapshot(topic)
+
+    def _snapshot(self, topic):
+        state = self._states.get(topic)
+        return self._versions.get(topic, 0), (dict(state) if state is not None else None)
+
+    def discard(self, topic):
+        with self._lock:
+            self._states.pop(topic, None)
+            self._versions.pop(topic, None)
+            self._notify(topic, self._conditions.pop(topic, None))
+        if self._store is not None:
+            self._store.discard(topic)
+
+    def purge(self, max_age):
+        """Drop topics nobody is streaming that have not changed for max_age seconds."""
+        cutoff = time.time() - max_age
+        with self._lock:
+            stale = [
+                topic for topic, state in self._states.items()
+                if state.get("last_update", 0) < cutoff
+                and topic not in self._conditions and topic not in self._watchers
+            ]
+            for topic in stale:
+                self._states.pop(topic, None)
+                self._versions.pop(topic, None)
+        if self._store is not None:
+            # Also sessions (and stop requests) of other processes; results expire with them
+            return len(stale) + self._store.purge(cutoff)
+        return len(stale)
+
+
+progress_bus = ProgressBus(analysis_progress, job_state if job_state.enabled else None)
+
+
 def progress_update(value, session_id=None):
     """
     Update the progress tracker for a specific session
     """
-    global analysis_progress
-
     # Use a default session ID if none provided
     if session_id is None:
         session_id = 'default'
 
-    # Store the progress value
-    if session_id not in analysis_progress:
-        analysis_progress[session_id] = {"value": 0, "last_update": time.time()}
-
-    analysis_progress[session_id]["value"] = value
-    analysis_progress[session_id]["last_update"] = time.time()
+    # Store the progress value and wake the session's SSE streams
+    progress_bus.publish(session_id, value=value)
 
     print(f"Progress updated for session {session_id}: {value}%")  # Debug output
 
-def apply_filters(df, filters):
-    """Apply the provided filters to the DataFrame"""
+def queue_position_update(position, session_id):
+    """
+    Record a session's place in the analysis queue (1 = next to start),
+    or None once a worker has picked it up
+    """
+    progress_bus.publish(session_id, queue_position=position)
+
+def progress_stopped(session_id):
+    """
+    Mark a session as stopped: progress back to 0 and a terminal flag, so its
+    SSE streams (in any worker process) finish even if progress never moved
+    """
+    progress_bus.publish(session_id, value=0, queue_position=None, stopped=True)
+
+
+class ProgressStream:
+    """
+    Message logic of one /api/progress subscriber, shared by the threaded
+    (Flask) and event-loop (ASGI) endpoints: feed advance() every
+    (version, state) the bus returns and send the SSE messages it yields.
+    """
+
+    def __init__(self, session_id):
+        self.session_id = session_id
+        self.version, state = progress_bus.subscribe(session_id)
+        self.last_position = state.get("queue_position")
+        self.last_value = state["value"]
+        self.stopped = bool(state.get("stopped"))
+        # Already finished (e.g. served from the analysis cache) or stopped: nothing more to stream
+        self.done = self.last_value >= 100 or self.stopped
+        print(f"Progress connection established for session {session_id}")
+
+    def start(self):
+        message = {"progress": self.last_value}
+        if self.last_position is not None:
+            message["queue_position"] = self.last_position
+        if self.stopped:
+            message["stopped"] = True
+        yield f"data: {json.dumps(message)}\n\n"
+
+    def advance(self, version, state):
+        if state is None:
+            # Session no longer exists
+            self.done = True
+            return
+        if version == self.version:
+            # SSE comment: keeps proxies from closing an idle stream
+            yield ": heartbeat\n\n"
+        self.version = version
+
+        # One message per wake-up, carrying queue movement while the job waits for a worker
+        current_value = state["value"]
+        current_position = state.get("queue_position")
+        message = {"progress": current_value}
+        if current_position != self.last_position:
+            message["queue_position"] = current_position
+            self.last_position = current_position
+        if state.get("stopped") and not self.stopped:
+            message["stopped"] = True
+            self.stopped = True
+        if current_value != self.last_value or len(message) > 1:
+            yield f"data: {json.dumps(message)}\n\n"
+            print(f"Sent progress update to client: {current_value}%")  # Debug output
+
+        if current_value != self.last_value:
+            self.last_value = current_value
+
+            # Finished or stopped: nothing more will be published
+            if current_value >= 100 or current_value == 0:
+                self.done = True
+                return
+
+        # Stopped while progress stayed at 0 (e.g. still queued)
+        if self.stopped:
+            self.done = True
+            return
+
+        # Check for stale connections (no updates for 60 seconds); queued jobs are not stale
+        if current_position is None and time.time() - state["last_update"] > 60:
+            print(f"Session {self.session_id} timed out")
+            self.done = True
+
+    def close(self):
+        progress_bus.discard(self.session_id)
+        print(f"Progress connection closed for session {self.session_id}")
+
+# Columns generate_analysis reads, plus 'type' which is only needed for filtering
+ANALYSIS_COLUMNS = ['country', 'area', 'latitude', 'longitude', 'acq_date', 'brightness',
+                    'confidence', 'frp', 'daynight', 'type', 'year']
+
+
+def build_filter_expression(filters, schema, date_column='acq_date'):
+    """
+    Translate the /api/analyze filter JSON into a PyArrow dataset expression so
+    rows are dropped while reading (row-group statistics can skip whole groups).
+    The date range applies to `date_column` (the analysis cube's is month_start).
+    Returns None when nothing is filtered.
+    """
+    conditions = []
+
+    def typed(column, value):
+        # Keep string columns compared as strings and date columns as dates
+        field_type = schema.field(column).type
+        if pa.types.is_string(field_type) or pa.types.is_large_string(field_type):
+            return str(value)
+        if pa.types.is_date(field_type):
+            return pd.Timestamp(value).date()
+        if pa.types.is_timestamp(field_type):
+            return pd.Timestamp(value).to_pydatetime()
+        return value
+
     # Filter by countries if specified
     countries = filters.get('countries', [])
     if countries:
-        df = df[df['country'].isin(countries)]
+        conditions.append(ds.field('country').isin(countries))
 
     # Filter by date range if specified
     date_range = filters.get('dateRange', {})
@@ -227,9 +1651,9 @@ def apply_filters(df, filters):
     end_date = date_range.get('end')
 
     if start_date:
-        df = df[df['acq_date'] >= start_date]
+        conditions.append(ds.field(date_column) >= typed(date_column, start_date))
     if end_date:
-        df = df[df['acq_date'] <= end_date]
+        conditions.append(ds.field(date_column) <= typed(date_column, end_date))
 
     # Filter by confidence level if specified
     confidence_range = filters.get('confidenceRange', {})
@@ -237,136 +1661,956 @@ def apply_filters(df, filters):
     max_confidence = confidence_range.get('max')
 
     if min_confidence is not None:
-        df = df[df['confidence'] >= min_confidence]
+        conditions.append(ds.field('confidence') >= min_confidence)
     if max_confidence is not None:
-        df = df[df['confidence'] <= max_confidence]
+        conditions.append(ds.field('confidence') <= max_confidence)
 
     # Filter by day/night if specified
     daynight = filters.get('daynight')
     if daynight:
-        df = df[df['daynight'] == daynight]
+        conditions.append(ds.field('daynight') == daynight)
 
     # Filter by fire type if specified
     fire_type = filters.get('type')
     if fire_type is not None:  # Use 'is not None' because fire_type could be 0
-        df = df[df['type'] == fire_type]
+        conditions.append(ds.field('type') == fire_type)
+
+    expression = None
+    for condition in conditions:
+        expression = condition if expression is None else expression & condition
+    return expression
 
-    return df
+
+def analysis_columns(schema_names):
+    """ANALYSIS_COLUMNS present in a year file, minus coordinates when it has areas."""
+    columns = [c for c in ANALYSIS_COLUMNS if c in schema_names]
+    # Coordinates are only used to synthesize areas when the file has none
+    if 'area' in columns:
+        columns = [c for c in columns if c not in ('latitude', 'longitude')]
+    return columns
+
+
+def row_group_fragments(dataset):
+    """
+    Split a dataset into (fragment, bytes) pairs: one per row group for Parquet
+    files, one per record batch for cached in-memory tables.
+    """
+    parts = []
+    for fragment in dataset.get_fragments():
+        if isinstance(fragment, ds.ParquetFileFragment):
+            for piece in fragment.split_by_row_group():
+                parts.append((piece, sum(rg.total_byte_size for rg in piece.row_groups)))
+        else:
+            parts.append((fragment, sum(batch.nbytes for batch in fragment.to_batches())))
+    return parts
+
+
+def scan_row_groups(dataset, columns, filter_expr, on_progress=None):
+    """
+    Read the rows matching filter_expr one row group at a time (predicate
+    pushdown still skips row groups by their statistics). on_progress is
+    called with each row group's byte size once it has been read.
+    """
+    tables = []
+    for fragment, nbytes in row_group_fragments(dataset):
+        tables.append(fragment.to_table(schema=dataset.schema, columns=columns, filter=filter_expr))
+        if on_progress:
+            on_progress(nbytes)
+    if not tables:
+        return dataset.schema.empty_table() if columns is None else dataset.schema.empty_table().select(columns)
+    return pa.concat_tables(tables)
+
+
+class AnalysisAggregate:
+    """
+    Mergeable partial state behind generate_analysis.
+    A single groupby over (country, area, year, month, daynight, confidence) keeps
+    row counts plus sum/count pairs for brightness, confidence and frp. Every stat
+    and chart in the analysis response is derived from that small grouped frame,
+    so partials computed per year file (or per chunk, in any order) can be
+    combined with merge() without ever holding the raw rows together.
+    """
+
+    KEYS = ['country', 'area', 'year', 'month', 'daynight', 'confidence']
+    MEASURES = ['brightness', 'confidence', 'frp']
+
+    def __init__(self, groups=None):
+        # DataFrame indexed by KEYS, or None for an empty aggregate
+        self.groups = groups
+
+    @property
+    def empty(self):
+        return self.groups is None or self.groups.empty
+
+    @staticmethod
+    def prepare_area(df):
+        """Fill or synthesize the 'area' column (modifies df in place)."""
+        # Only create a placeholder if the 'area' column doesn't exist
+        if 'area' not in df.columns:
+            # Create areas based on latitude/longitude grid (simplified for demonstration)
+            if 'latitude' in df.columns and 'longitude' in df.columns:
+                # Round coordinates to create area "buckets"
+                df['area'] = [f"Region {round(lat, 1)}/{round(lon, 1)}"
+                              for lat, lon in zip(df['latitude'], df['longitude'])]
+            else:
+                # Fallback if no coordinates
+                df['area'] = "Unknown Area"
+        elif df['area'].isnull().any():
+            # If 'area' column exists but has null values, replace nulls with "Unknown Area"
+            df['area'] = df['area'].fillna("Unknown Area")
+        return df
+
+    @classmethod
+    def prepare(cls, df):
+        """Add the derived 'area' and 'month' columns the aggregates group by."""
+        df = cls.prepare_area(df.copy())
+
+        # Convert acq_date to datetime if it's not already
+        if not pd.api.types.is_datetime64_any_dtype(df['acq_date']):
+            df['acq_date'] = pd.to_datetime(df['acq_date'])
+        df['month'] = df['acq_date'].dt.month
+        return df
+
+    @classmethod
+    def from_frame(cls, df):
+        """Build the partial aggregate for one chunk of (already filtered) rows."""
+        if df.empty:
+            return cls()
+        df = cls.prepare(df)
+        keys = [k for k in cls.KEYS if k in df.columns]
+        named = {"count": (keys[0], "size")}
+        for col in cls.MEASURES:
+            named[f"{col}_sum"] = (col, "sum")
+            named[f"{col}_n"] = (col, "count")
+        groups = df.groupby(keys, dropna=False, sort=False, observed=True).agg(**named)
+        return cls(groups)
+
+    @classmethod
+    def from_cube(cls, cube):
+        """Build the partial aggregate from (filtered) analysis cube rows."""
+        if cube.empty:
+            return cls()
+        cube = cube.copy()
+        cube['month'] = pd.to_datetime(cube['month_start']).dt.month
+        keys = [k for k in cls.KEYS if k in cube.columns]
+        measures = ['count'] + [f"{col}_{part}" for col in cls.MEASURES for part in ('sum', 'n')]
+        groups = cube.groupby(keys, dropna=False, sort=False, observed=True)[measures].sum()
+        return cls(groups)
+
+    def merge(self, other):
+        """Combine two partials; counts and sums add up group by group."""
+        if other.empty:
+            return self
+        if self.empty:
+            return other
+        combined = pd.concat([self.groups, other.groups])
+        groups = combined.groupby(level=list(combined.index.names), dropna=False, sort=False).sum()
+        return AnalysisAggregate(groups)
+
+    def result(self):
+        """Produce the {"data", "stats"} payload the dashboard consumes."""
+        if self.empty:
+            # No rows: the same payload with zero counts and NaN averages
+            measures = ['count'] + [f"{col}_{part}" for col in self.MEASURES for part in ('sum', 'n')]
+            g = pd.DataFrame(columns=self.KEYS + measures)
+        else:
+            g = self.groups.reset_index()
+
+        def mean(col):
+            n = g[f"{col}_n"].sum()
+            return float(g[f"{col}_sum"].sum() / n) if n else float('nan')
+
+        def counts_by(keys):
+            return g.groupby(keys)['count'].sum().reset_index(name='count')
+
+        # Get list of countries and check if only one is selected
+        unique_countries = g['country'].unique().tolist()
+        single_country_selected = len(unique_countries) == 1
+        selected_country = unique_countries[0] if single_country_selected else ""
+
+        print(f"Countries in data: {unique_countries}")
+        print(f"Single country selected: {single_country_selected}, Country: {selected_country}")
+
+        # Basic statistics
+        stats = {
+            "total_fires": int(g['count'].sum()),
+            "avg_brightness": mean('brightness'),
+            "avg_confidence": mean('confidence'),
+            "avg_frp": mean('frp'),
+            "day_fires": int(g.loc[g['daynight'] == 'D', 'count'].sum()),
+            "night_fires": int(g.loc[g['daynight'] == 'N', 'count'].sum())
+        }
+
+        # Time series data by month
+        monthly_data = counts_by('month').to_dict(orient='records')
+
+        # Country-wise data
+        country_data = counts_by('country')
+        country_data = country_data.sort_values('count', ascending=False).head(10)
+        country_data = country_data.to_dict(orient='records')
+
+        # Area-wise data (if single country selected)
+        area_data = []
+        if single_country_selected:
+            area_data = counts_by('area')
+            area_data = area_data.sort_values('count', ascending=False).head(10)
+            area_data = area_data.to_dict(orient='records')
+            print(f"Area data for {selected_country} (count: {len(area_data)}):", area_data)
+
+        # FRP distribution by confidence
+        frp = g.groupby('confidence')[['frp_sum', 'frp_n']].sum()
+        frp_confidence = (frp['frp_sum'] / frp['frp_n'].where(frp['frp_n'] > 0)).rename('frp').reset_index()
+        frp_confidence = frp_confidence.to_dict(orient='records')
+
+        # Day vs Night comparison by month
+        day_night_monthly = counts_by(['month', 'daynight']).to_dict(orient='records')
+
+        # Year over year comparison if multiple years
+        year_data = counts_by('year').to_dict(orient='records')
+
+        # Selection info
+        selection_info = {
+            "single_country_selected": single_country_selected,
+            "selected_country": selected_country,
+            "has_area_data": len(area_data) > 0
+        }
+
+        data = {
+            "monthly": monthly_data,
+            "country": country_data,
+            "area": area_data,
+            "frp_confidence": frp_confidence,
+            "day_night_monthly": day_night_monthly,
+            "yearly": year_data,
+            "selection_info": selection_info
+        }
+
+        return {"data": data, "stats": stats}
 
 
 def generate_analysis(df):
     """Generate analysis results from the filtered data"""
-    # Create a copy to avoid SettingWithCopyWarning
-    df_analysis = df.copy()
-
-    # Get list of countries and check if only one is selected
-    unique_countries = df_analysis['country'].unique().tolist()
-    single_country_selected = len(unique_countries) == 1
-    selected_country = unique_countries[0] if single_country_selected else ""
-
-    print(f"Countries in data: {unique_countries}")
-    print(f"Single country selected: {single_country_selected}, Country: {selected_country}")
-
-    # Check if 'area' column exists
-    has_area_column = 'area' in df_analysis.columns
-    print(f"Has 'area' column: {has_area_column}")
-
-    # Only create a placeholder if the 'area' column doesn't exist
-    if not has_area_column:
-        print("'area' column not found in data, adding placeholder")
-        # Create areas based on latitude/longitude grid (simplified for demonstration)
-        if 'latitude' in df_analysis.columns and 'longitude' in df_analysis.columns:
-            # Round coordinates to create area "buckets"
-            df_analysis['area'] = df_analysis.apply(
-                lambda row: f"Region {round(row['latitude'], 1)}/{round(row['longitude'], 1)}",
-                axis=1
-            )
+    return AnalysisAggregate.from_frame(df).result()
+
+
+# Dimensions of the per-year analysis cube. Every /api/analyze filter maps to one
+# of them; confidence is kept exact (MODIS confidence is an integer percentage)
+# so confidence ranges and the frp-by-confidence chart stay exact. Dates are kept
+# per month (the analysis charts are monthly), which makes the cube several times
+# smaller than the raw data; date ranges that split a month are read raw.
+CUBE_KEYS = ['year', 'country', 'area', 'month_start', 'daynight', 'type', 'confidence']
+CUBE_FILTERS = {'years', 'countries', 'dateRange', 'confidenceRange', 'daynight', 'type'}
+
+
+def cube_serves(filters):
+    """
+    Whether the cube can answer a filter set: every active filter is a cube
+    dimension and the date range, if any, covers whole months.
+    """
+    active = {k for k, v in filters.items() if v not in (None, [], {}, '')}
+    if not active <= CUBE_FILTERS:
+        return False
+    date_range = filters.get('dateRange') or {}
+    start_date, end_date = date_range.get('start'), date_range.get('end')
+    if start_date and pd.Timestamp(start_date).day != 1:
+        return False
+    if end_date and not pd.Timestamp(end_date).is_month_end:
+        return False
+    return True
+
+
+def analysis_cube_path(year_path):
+    """data/modis/{year}.parquet -> data/modis/.cube/{year}.parquet"""
+    return os.path.join(os.path.dirname(year_path), ".cube", os.path.basename(year_path))
+
+
+def cube_partial(batch):
+    """Cube rows (indexed by CUBE_KEYS) for one record batch of a year file."""
+    df = AnalysisAggregate.prepare_area(batch.to_pandas())
+    df['month_start'] = pd.to_datetime(df['acq_date']).dt.to_period('M').dt.start_time.dt.date
+
+    named = {"count": ('year', "size")}
+    for col in AnalysisAggregate.MEASURES:
+        named[f"{col}_sum"] = (col, "sum")
+        named[f"{col}_n"] = (col, "count")
+    return df.groupby(CUBE_KEYS, dropna=False, sort=False, observed=True).agg(**named)
+
+
+def build_analysis_cube(year_path, table=None):
+    """
+    Materialize the aggregate cube for one year file: row counts and
+    brightness/confidence/frp sum+count per CUBE_KEYS combination.
+    The year is aggregated one record batch at a time and the month-keyed
+    partials are merged like AnalysisAggregate.merge, so only one batch is
+    ever converted to pandas.
+    Pass the already-loaded Arrow table to skip re-reading the year file.
+    Returns the cube path, or None if the file lacks a cube dimension.
+    """
+    schema = table.schema if table is not None else pq.read_schema(year_path)
+    if not set(CUBE_KEYS) - {'area', 'month_start'} | {'acq_date'} <= set(schema.names):
+        return None
+
+    columns = analysis_columns(schema.names)
+    if table is not None:
+        batches = table.select(columns).to_batches(max_chunksize=CONVERT_ROW_GROUP_SIZE)
+    else:
+        batches = pq.ParquetFile(year_path).iter_batches(batch_size=CONVERT_ROW_GROUP_SIZE, columns=columns)
+
+    cube = None
+    for batch in batches:
+        partial = cube_partial(batch)
+        if cube is None:
+            cube = partial
         else:
-            # Fallback if no coordinates
-            df_analysis['area'] = "Unknown Area"
+            combined = pd.concat([cube, partial])
+            cube = combined.groupby(level=CUBE_KEYS, dropna=False, sort=False).sum()
+    if cube is None:
+        # No rows: an empty cube with the same columns
+        cube = cube_partial(pa.schema([schema.field(c) for c in columns]).empty_table())
+    cube = cube.sort_index().reset_index()
+
+    cube_table = pa.Table.from_pandas(cube, preserve_index=False)
+    cube_table = cube_table.replace_schema_metadata({
+        "source_version": file_version(year_path), "cube_keys": ",".join(CUBE_KEYS)
+    })
+
+    cube_path = analysis_cube_path(year_path)
+    os.makedirs(os.path.dirname(cube_path), exist_ok=True)
+    tmp_path = f"{cube_path}.{uuid.uuid4().hex}.tmp"
+    pq.write_table(cube_table, tmp_path, compression="snappy")
+    os.replace(tmp_path, cube_path)
+    return cube_path
+
+
+def cube_is_current(year_path):
+    """Whether the year's cube exists and was built from this version of the file with CUBE_KEYS."""
+    cube_path = analysis_cube_path(year_path)
+    if not os.path.exists(cube_path):
+        return False
+    metadata = pq.read_schema(cube_path).metadata or {}
+    # Rebuilt when the year file changes or the cube was written with other dimensions
+    return (metadata.get(b"source_version", b"").decode() == file_version(year_path)
+            and metadata.get(b"cube_keys", b"").decode() == ",".join(CUBE_KEYS))
+
+
+def load_analysis_cube(year_path):
+    """Return the year's cube table (from the shared cache), building it if missing or stale."""
+    if cube_is_current(year_path):
+        return year_tables.get(analysis_cube_path(year_path))
+    cube_path = build_analysis_cube(year_path)
+    return year_tables.get(cube_path) if cube_path else None
+
+
+def analysis_source(file_path, filters):
+    """
+    Choose what to scan for one year file: ("cube", dataset) when the cube
+    serves the filters (building a missing or stale cube first),
+    otherwise ("raw", dataset) over the fire points themselves.
+    """
+    if cube_serves(filters):
+        cube = load_analysis_cube(file_path)
+        if cube is not None:
+            return "cube", ds.dataset(cube)
+    # Scan the shared table if it is already in memory; otherwise read the Parquet
+    # file, which decodes only the analysis columns of the row groups that match
+    table = year_tables.get(file_path, decode=False)
+    if table is not None:
+        return "raw", ds.dataset(table)
+    return "raw", ds.dataset(file_path, format="parquet")
+
+
+def analysis_column_bytes(file_path):
+    """Uncompressed size of a year file's analysis columns, from its Parquet metadata."""
+    metadata = pq.read_metadata(file_path)
+    names = metadata.schema.to_arrow_schema().names
+    indices = [names.index(c) for c in ANALYSIS_COLUMNS if c in names]
+    return sum(
+        metadata.row_group(i).column(j).total_uncompressed_size
+        for i in range(metadata.num_row_groups) for j in indices
+    )
+
+
+def planned_source_bytes(file_path, filters):
+    """
+    Bytes that analysing one year file will read, without building anything:
+    the source analysis_source would pick, or, when the year's cube is missing
+    or stale, the year's analysis columns that building it reads.
+    """
+    if cube_serves(filters) and not cube_is_current(file_path):
+        return analysis_column_bytes(file_path)
+    _, dataset = analysis_source(file_path, filters)
+    return sum(nbytes for _, nbytes in row_group_fragments(dataset))
+
+
+def source_aggregate(kind, dataset, filters, on_progress=None):
+    """Partial analysis aggregate from a source returned by analysis_source."""
+    columns = None if kind == "cube" else analysis_columns(dataset.schema.names)
+    date_column = 'month_start' if kind == "cube" else 'acq_date'
+    table = scan_row_groups(dataset, columns, build_filter_expression(filters, dataset.schema, date_column),
+                            on_progress)
+    if not table.num_rows:
+        return AnalysisAggregate()
+    if kind == "cube":
+        return AnalysisAggregate.from_cube(table.to_pandas())
+    return AnalysisAggregate.from_frame(table.to_pandas())
+
+
+def year_aggregate(file_path, filters, on_progress=None):
+    """
+    Partial analysis aggregate for one year file.
+    Answered from the precomputed cube when every filter maps to a cube
+    dimension, otherwise from a (pushed-down) scan of the raw fire points.
+    """
+    kind, dataset = analysis_source(file_path, filters)
+    return source_aggregate(kind, dataset, filters, on_progress)
+
+
+class DataCatalog:
+    """
+    Persistent catalog of the {year}.parquet files in a data folder: per year
+    its file version, row count and acq_date range, and the same per country
+    (in file order). Kept in <folder>/.catalog.json; a year is re-read (only
+    its country/acq_date columns) when its mtime/size change. Lookups are
+    served from memory and the folder is re-checked at most every
+    CATALOG_SYNC_INTERVAL seconds.
+    """
+
+    def __init__(self, data_folder=DATA_FOLDER, sync_interval=CATALOG_SYNC_INTERVAL):
+        self.data_folder = data_folder
+        self.path = os.path.join(data_folder, ".catalog.json")
+        self.sync_interval = sync_interval
+        self._years = None
+        self._checked_at = 0.0
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def summarize(year_path):
+        """Catalog entry of one year file."""
+        schema_names = pq.read_schema(year_path).names
+        columns = [c for c in ('country', 'acq_date') if c in schema_names]
+        table = pq.read_table(year_path, columns=columns)
+        entry = {"version": file_version(year_path), "rows": table.num_rows,
+                 "min_date": None, "max_date": None, "countries": {}}
+        if 'acq_date' in columns and table.num_rows:
+            dates = table.column('acq_date').cast(pa.string())
+            entry["min_date"], entry["max_date"] = pc.min(dates).as_py(), pc.max(dates).as_py()
+            table = table.set_column(table.schema.get_field_index('acq_date'), 'acq_date', dates)
+        if 'country' in columns:
+            aggregations = [([], 'count_all')]
+            if 'acq_date' in columns:
+                aggregations += [('acq_date', 'min'), ('acq_date', 'max')]
+            # Single-threaded grouping keeps countries in order of first appearance
+            groups = table.group_by('country', use_threads=False).aggregate(aggregations).to_pylist()
+            entry["countries"] = {
+                str(g['country']): {"rows": g['count_all'], "min_date": g.get('acq_date_min'),
+                                    "max_date": g.get('acq_date_max')}
+                for g in groups
+            }
+        return entry
+
+    def _load(self):
+        try:
+            with open(self.path) as f:
+                return json.load(f).get("years", {})
+        except (OSError, ValueError):
+            return {}
+
+    def sync(self, force=False):
+        """Bring the catalog in line with the folder; returns {year: entry}."""
+        with self._lock:
+            if not force and self._years is not None and time.time() - self._checked_at < self.sync_interval:
+                return self._years
+            years = self._load() if self._years is None else self._years
+            files = {
+                os.path.basename(year_path)[:-len(".parquet")]: year_path
+                for year_path in year_file_paths(self.data_folder)
+            }
+            changed = False
+            for year in [y for y in years if y not in files]:
+                del years[year]
+                changed = True
+            for year, year_path in files.items():
+                if years.get(year, {}).get("version") != file_version(year_path):
+                    years[year] = self.summarize(year_path)
+                    changed = True
+            if changed:
+                tmp_path = f"{self.path}.{uuid.uuid4().hex}.tmp"
+                with open(tmp_path, "w") as f:
+                    json.dump({"years": years}, f)
+                os.replace(tmp_path, self.path)
+            self._years = years
+            self._checked_at = time.time()
+            return years
+
+    def years(self):
+        return sorted(self.sync())
+
+    def countries(self, years=None):
+        """Countries of the given years (all years when None), in catalog order."""
+        catalog = self.sync()
+        countries = {}
+        for year in (years if years is not None else sorted(catalog)):
+            for country in catalog.get(str(year), {}).get("countries", {}):
+                countries[country] = True
+        return list(countries)
+
+
+data_catalog = DataCatalog()
+
+
+def catalog_for(folder):
+    """The served catalog for DATA_FOLDER, a throwaway one for any other folder."""
+    if os.path.abspath(folder) == os.path.abspath(DATA_FOLDER):
+        return data_catalog
+    return DataCatalog(folder)
+
+
+def available_years():
+    """Year names of the data/modis/{year}.parquet files."""
+    return data_catalog.years()
+
+
+class AnalysisResultCache:
+    """
+    LRU + TTL cache of completed /api/analyze results.
+    Keys are a hash of the canonicalized filter JSON and the mtime/size of the
+    year files the analysis reads, so replacing any of those files changes the
+    key and stale results simply stop being hit.
+    """
+
+    def __init__(self, max_size=ANALYSIS_CACHE_SIZE, ttl=ANALYSIS_CACHE_TTL):
+        self.max_size = max(1, max_size)
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    @staticmethod
+    def normalize_filters(filters):
+        """Canonical form of the filter JSON: empty values dropped, lists sorted, years expanded."""
+        normalized = {}
+        for key, value in (filters or {}).items():
+            if isinstance(value, dict):
+                value = {k: v for k, v in value.items() if v not in (None, '')}
+            if value in (None, '', [], {}):
+                continue
+            if isinstance(value, list):
+                value = sorted({str(v) for v in value})
+            normalized[key] = value
+        # An empty year selection means "all years" – make that explicit
+        normalized['years'] = normalized.get('years') or sorted(available_years())
+        return normalized
+
+    def key_for(self, filters):
+        normalized = self.normalize_filters(filters)
+        versions = {}
+        for year in normalized['years']:
+            file_path = os.path.join(DATA_FOLDER, f"{year}.parquet")
+            versions[year] = file_version(file_path) if os.path.exists(file_path) else None
+        payload = json.dumps({"filters": normalized, "data_version": versions}, sort_keys=True)
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def get(self, key):
+        """Return (found, result); result is None for analyses that matched no rows."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and time.time() - entry["stored_at"] > self.ttl:
+                del self._entries[key]
+                self.expirations += 1
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return False, None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return True, entry["result"]
+
+    def put(self, key, result):
+        with self._lock:
+            self._entries[key] = {"result": result, "stored_at": time.time()}
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "size": len(self._entries),
+                "max_size": self.max_size,
+                "ttl": self.ttl,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "expirations": self.expirations,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+            }
+
+
+analysis_cache = AnalysisResultCache()
+
+
+# ------------------------------
+# Function: Heatmap aggregation
+# ------------------------------
+def heatmap_cells(file_path, country, resolution, start_date=None, end_date=None):
+    """
+    Bin one year's fires (optionally one country and a date range) into a
+    `resolution`-degree lat/lon grid. Returns an Arrow table with one row per
+    non-empty cell: its center latitude/longitude, the fire count and the
+    mean brightness. Vectorized with np.unique + np.bincount.
+    """
+    columns = ['latitude', 'longitude', 'brightness']
+    filters = {"countries": [country] if country else [], "dateRange": {"start": start_date, "end": end_date}}
+    table = year_tables.get(file_path, decode=False)
+    if table is not None:
+        # Filter the shared year table another endpoint already decoded
+        filter_expr = build_filter_expression(filters, table.schema)
+        table = (table.filter(filter_expr) if filter_expr is not None else table).select(columns)
     else:
-        # If 'area' column exists but has null values, replace nulls with "Unknown Area"
-        if df_analysis['area'].isnull().any():
-            print("Replacing null area values with 'Unknown Area'")
-            df_analysis['area'] = df_analysis['area'].fillna("Unknown Area")
-
-        # Check the first few areas to see what's in the data
-        print("Sample area values:", df_analysis['area'].head(5).tolist())
-
-    # Convert acq_date to datetime if it's not already
-    if not pd.api.types.is_datetime64_any_dtype(df_analysis['acq_date']):
-        df_analysis['acq_date'] = pd.to_datetime(df_analysis['acq_date'])
-
-    # Create month and day fields for temporal analysis
-    df_analysis['month'] = df_analysis['acq_date'].dt.month
-    df_analysis['day'] = df_analysis['acq_date'].dt.day
-
-    # Basic statistics
-    stats = {
-        "total_fires": len(df_analysis),
-        "avg_brightness": float(df_analysis['brightness'].mean()),
-        "avg_confidence": float(df_analysis['confidence'].mean()),
-        "avg_frp": float(df_analysis['frp'].mean()),
-        "day_fires": int(df_analysis[df_analysis['daynight'] == 'D'].shape[0]),
-        "night_fires": int(df_analysis[df_analysis['daynight'] == 'N'].shape[0])
-    }
+        # Read only the binned columns and push the country/date filter down, so
+        # country-sorted files only decode the matching row groups
+        filter_expr = build_filter_expression(filters, pq.read_schema(file_path))
+        table = pq.read_table(file_path, columns=columns, filters=filter_expr)
+
+    lat = table.column('latitude').to_numpy()
+    lon = table.column('longitude').to_numpy()
+    brightness = table.column('brightness').to_numpy(zero_copy_only=False).astype(np.float64)
+    grid_columns = int(np.ceil(360 / resolution)) + 1
+    rows = np.floor((lat + 90) / resolution).astype(np.int64)
+    cols = np.floor((lon + 180) / resolution).astype(np.int64)
+    cells, inverse, counts = np.unique(rows * grid_columns + cols, return_inverse=True, return_counts=True)
+
+    # Mean over the fires that have a brightness value
+    valid = ~np.isnan(brightness)
+    sums = np.bincount(inverse[valid], weights=brightness[valid], minlength=len(cells))
+    measured = np.bincount(inverse[valid], minlength=len(cells))
+    with np.errstate(invalid='ignore', divide='ignore'):
+        mean_brightness = np.where(measured > 0, sums / np.maximum(measured, 1), np.nan)
+
+    return pa.table({
+        'latitude': (cells // grid_columns + 0.5) * resolution - 90,
+        'longitude': (cells % grid_columns + 0.5) * resolution - 180,
+        'count': counts.astype(np.int64),
+        'brightness': pa.array(np.round(mean_brightness, 2), from_pandas=True),
+    })
 
-    # Time series data by month
-    monthly_data = df_analysis.groupby('month').size().reset_index(name='count')
-    monthly_data = monthly_data.to_dict(orient='records')
-
-    # Country-wise data
-    country_data = df_analysis.groupby('country').size().reset_index(name='count')
-    country_data = country_data.sort_values('count', ascending=False).head(10)
-    country_data = country_data.to_dict(orient='records')
-
-    # Area-wise data (if single country selected)
-    area_data = []
-    if single_country_selected:
-        # Group by area
-        area_data = df_analysis.groupby('area').size().reset_index(name='count')
-        area_data = area_data.sort_values('count', ascending=False).head(10)
-        area_data = area_data.to_dict(orient='records')
-        print(f"Area data for {selected_country} (count: {len(area_data)}):", area_data)
-
-    # FRP distribution by confidence
-    frp_confidence = df_analysis.groupby('confidence')['frp'].mean().reset_index()
-    frp_confidence = frp_confidence.to_dict(orient='records')
-
-    # Day vs Night comparison by month
-    day_night_monthly = df_analysis.groupby(['month', 'daynight']).size().reset_index(name='count')
-    day_night_monthly = day_night_monthly.to_dict(orient='records')
-
-    # Year over year comparison if multiple years
-    year_data = df_analysis.groupby('year').size().reset_index(name='count')
-    year_data = year_data.to_dict(orient='records')
-
-    # Selection info
-    selection_info = {
-        "single_country_selected": single_country_selected,
-        "selected_country": selected_country,
-        "has_area_data": len(area_data) > 0
-    }
 
-    data = {
-        "monthly": monthly_data,
-        "country": country_data,
-        "area": area_data,
-        "frp_confidence": frp_confidence,
-        "day_night_monthly": day_night_monthly,
-        "yearly": year_data,
-        "selection_info": selection_info
-    }
+class HeatmapCache:
+    """
+    LRU cache of heatmap cell tables, keyed by (year file, its mtime/size,
+    country, resolution, date range). A replaced year file changes the key,
+    so entries never go stale and need no TTL.
+    """
 
-    return {"data": data, "stats": stats}
+    def __init__(self, max_size=HEATMAP_CACHE_SIZE):
+        self.max_size = max(1, max_size)
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
 
+    @staticmethod
+    def key_for(file_path, country, resolution, start_date=None, end_date=None):
+        return (file_path, file_version(file_path), country, resolution, start_date, end_date)
 
+    def get(self, key):
+        """Return the cached cell table, or None."""
+        with self._lock:
+            cells = self._entries.get(key)
+            if cells is not None:
+                self._entries.move_to_end(key)
+            return cells
 
+    def put(self, key, cells):
+        with self._lock:
+            self._entries[key] = cells
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
 
 
+heatmap_cache = HeatmapCache()
 
 
+class AnalysisResultStore:
+    """
+    Finished /api/analyze results per session, kept as ready-to-send JSON bytes.
+    Entries expire RESULTS_TTL seconds after they were stored. The least recently
+    read ones leave memory once RESULTS_MEMORY_MB or RESULTS_MAX_SESSIONS is
+    exceeded: they are spilled as gzip files to RESULTS_SPILL_DIR (read back on
+    demand) or, with spilling disabled, dropped.
+    With a shared store every result is also written there, so other worker
+    processes can serve it, and the store replaces the spill files.
+    """
 
+    def __init__(self, ttl=RESULTS_TTL, memory_mb=RESULTS_MEMORY_MB, max_sessions=RESULTS_MAX_SESSIONS,
+                 spill_dir=RESULTS_SPILL_DIR, shared=None):
+        self.ttl = ttl
+        self.shared = shared
+        self.memory_budget = int(memory_mb * 1024 * 1024)
+        self.max_sessions = max(1, max_sessions)
+        self.spill_dir = spill_dir or None
+        self._memory = OrderedDict()  # session_id -> {"body", "stored_at"}
+        self._spilled = {}  # session_id -> stored_at
+        self._memory_bytes = 0
+        self._lock = threading.Lock()
+        self.spills = 0
+        self.drops = 0
+        self.expirations = 0
+
+    def _spill_path(self, session_id):
+        return os.path.join(self.spill_dir, f"{session_id}.json.gz")
+
+    def _remove_spilled(self, session_id):
+        self._spilled.pop(session_id, None)
+        try:
+            os.remove(self._spill_path(session_id))
+        except OSError:
+            pass
+
+    def _evict(self):
+        while self._memory and (self._memory_bytes > self.memory_budget or len(self._memory) > self.max_sessions):
+            session_id, entry = self._memory.popitem(last=False)
+            self._memory_bytes -= len(entry["body"])
+            if self.shared is not None:
+                self.spills += 1  # Already in the shared store
+            elif self.spill_dir:
+                os.makedirs(self.spill_dir, exist_ok=True)
+                with open(self._spill_path(session_id), "wb") as f:
+                    f.write(gzip.compress(entry["body"], compresslevel=5))
+                self._spilled[session_id] = entry["stored_at"]
+                self.spills += 1
+            else:
+                self.drops += 1
+
+    def put(self, session_id, result):
+        body = f"{app.json.dumps(result)}\n".encode("utf-8")
+        stored_at = time.time()
+        if self.shared is not None:
+            self.shared.put_result(session_id, body, stored_at)
+        with self._lock:
+            self._remove_spilled(session_id)
+            previous = self._memory.pop(session_id, None)
+            if previous is not None:
+                self._memory_bytes -= len(previous["body"])
+            self._memory[session_id] = {"body": body, "stored_at": stored_at}
+            self._memory_bytes += len(body)
+            self._evict()
+
+    def get(self, session_id):
+        """JSON bytes of the session's results, or None if unknown or expired."""
+        now = time.time()
+        with self._lock:
+            entry = self._memory.get(session_id)
+            if entry is not None:
+                if now - entry["stored_at"] > self.ttl:
+                    del self._memory[session_id]
+                    self._memory_bytes -= len(entry["body"])
+                    self.expirations += 1
+                    return None
+                self._memory.move_to_end(session_id)
+                return entry["body"]
+
+            stored_at = self._spilled.get(session_id)
+            if stored_at is None:
+                if self.shared is None:
+                    return None
+                # Stored by another worker process (or evicted from this one's memory)
+                return self.shared.get_result(session_id, now - self.ttl)
+            if now - stored_at > self.ttl:
+                self._remove_spilled(session_id)
+                self.expirations += 1
+                return None
+            try:
+                with open(self._spill_path(session_id), "rb") as f:
+                    return gzip.decompress(f.read())
+            except OSError:
+                self._spilled.pop(session_id, None)
+                return None
+
+    def purge_expired(self):
+        """Forget results older than the TTL, in memory and on disk."""
+        cutoff = time.time() - self.ttl
+        with self._lock:
+            for session_id in [s for s, e in self._memory.items() if e["stored_at"] < cutoff]:
+                self._memory_bytes -= len(self._memory.pop(session_id)["body"])
+                self.expirations += 1
+            for session_id in [s for s, stored_at in self._spilled.items() if stored_at < cutoff]:
+                self._remove_spilled(session_id)
+                self.expirations += 1
+            # Spill files left behind by an earlier process
+            if self.spill_dir and os.path.isdir(self.spill_dir):
+                for name in os.listdir(self.spill_dir):
+                    session_id = name[:-len(".json.gz")]
+                    path = os.path.join(self.spill_dir, name)
+                    if session_id not in self._spilled and os.path.getmtime(path) < cutoff:
+                        os.remove(path)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "in_memory": len(self._memory),
+                "memory_mb": round(self._memory_bytes / (1024 * 1024), 2),
+                "memory_budget_mb": round(self.memory_budget / (1024 * 1024), 2),
+                "spilled": len(self._spilled),
+                "spills": self.spills,
+                "drops": self.drops,
+                "expirations": self.expirations,
+                "ttl": self.ttl,
+                "shared": self.shared is not None,
+            }
+
+
+results_store = AnalysisResultStore(shared=job_state if job_state.enabled else None)
+
+
+def estimate_analysis_cost(filters):
+    """
+    Rough peak memory (bytes) of one analysis job. Years are aggregated one at a
+    time, so the peak is the largest single year's decoded input (its cube when
+    the filters allow it, otherwise the raw analysis columns), times a factor for
+    the pandas conversion and groupby.
+    """
+    years = filters.get('years') or available_years()
+    use_cube = cube_serves(filters)
+    largest = 0
+    for year in years:
+        file_path = os.path.join(DATA_FOLDER, f"{year}.parquet")
+        if not os.path.exists(file_path):
+            continue
+        cube_path = analysis_cube_path(file_path)
+        if use_cube and os.path.exists(cube_path):
+            metadata = pq.read_metadata(cube_path)
+            size = sum(metadata.row_group(i).total_byte_size for i in range(metadata.num_row_groups))
+        else:
+            size = analysis_column_bytes(file_path)
+        largest = max(largest, size)
+    return largest * 3
+
+
+class AnalysisJob:
+    def __init__(self, session_id, fn, cost):
+        self.session_id = session_id
+        self.fn = fn
+        self.cost = cost
+        self.cancel = CancelToken(session_id, job_state if job_state.enabled else None)
+
+
+class AnalysisScheduler:
+    """
+    Fixed-size worker pool for /api/analyze jobs.
+    Jobs wait in a FIFO queue and a worker starts the next one only when its
+    estimated memory cost fits in what is left of the memory budget (a job always
+    runs when nothing else is running, so oversized jobs still finish).
+    Every job has its own cancel token, so stopping one session leaves the rest
+    running. Queue positions are published to the session's progress entry.
+    Each worker process has its own scheduler, workers and memory budget.
+    """
+
+    def __init__(self, workers=ANALYSIS_WORKERS, max_queue=ANALYSIS_QUEUE_SIZE,
+                 memory_budget_mb=ANALYSIS_MEMORY_BUDGET_MB):
+        self.workers = max(1, workers)
+        self.max_queue = max_queue
+        self.memory_budget = int(memory_budget_mb * 1024 ** 2)
+        self._queue = deque()
+        self._jobs = {}
+        self._cond = threading.Condition()
+        self._threads = []
+        self._running = 0
+        self._running_cost = 0
+        self.completed = 0
+        self.cancelled = 0
+
+    def _start_workers(self):
+        # Started on first use so importing the module (e.g. in worker processes) spawns no threads
+        while len(self._threads) < self.workers:
+            thread = threading.Thread(target=self._worker, name=f"analysis-{len(self._threads)}")
+            thread.daemon = True  # Daemon thread will be killed when the main process exits
+            thread.start()
+            self._threads.append(thread)
+
+    def _publish_positions(self):
+        for position, job in enumerate(self._queue, start=1):
+            queue_position_update(position, job.session_id)
+
+    def _can_start(self):
+        if not self._queue:
+            return False
+        return self._running == 0 or self._running_cost + self._queue[0].cost <= self.memory_budget
+
+    def submit(self, session_id, fn, cost=0):
+        """Queue fn(cancel_event); returns the queue position. Raises queue.Full."""
+        with self._cond:
+            self._start_workers()
+            if len(self._queue) >= self.max_queue:
+                raise Full(f"Analysis queue is full ({self.max_queue} jobs waiting)")
+            job = AnalysisJob(session_id, fn, cost)
+            self._jobs[session_id] = job
+            self._queue.append(job)
+            self._publish_positions()
+            self._cond.notify_all()
+            return len(self._queue)
+
+    def cancel(self, session_id):
+        """Signal one session's job to stop; queued jobs are dropped immediately."""
+        with self._cond:
+            job = self._jobs.get(session_id)
+            if job is None:
+                return False
+            job.cancel.set()
+            if job in self._queue:
+                self._queue.remove(job)
+                del self._jobs[session_id]
+                queue_position_update(None, session_id)
+                self._publish_positions()
+            self.cancelled += 1
+            self._cond.notify_all()
+            return True
+
+    def _worker(self):
+        while True:
+            with self._cond:
+                while not self._can_start():
+                    self._cond.wait()
+                job = self._queue.popleft()
+                self._running += 1
+                self._running_cost += job.cost
+                queue_position_update(None, job.session_id)
+                self._publish_positions()
+            try:
+                # Skip jobs stopped through another worker process while they were queued
+                if not job.cancel.is_set():
+                    job.fn(job.cancel)
+            finally:
+                with self._cond:
+                    self._running -= 1
+                    self._running_cost -= job.cost
+                    self._jobs.pop(job.session_id, None)
+                    self.completed += 1
+                    self._cond.notify_all()
+
+    def stats(self):
+        with self._cond:
+            return {
+                "workers": self.workers,
+                "running": self._running,
+                "queued": len(self._queue),
+                "max_queue": self.max_queue,
+                "running_cost_mb": round(self._running_cost / 1024 ** 2, 1),
+                "memory_budget_mb": round(self.memory_budget / 1024 ** 2, 1),
+                "completed": self.completed,
+                "cancelled": self.cancelled,
+            }
+
+
+analysis_scheduler = AnalysisScheduler()
 
 
 # -------------------------------
@@ -381,11 +2625,104 @@ def predict_route():
     if not country or not start_date:
         return jsonify({'error': 'country and start_date required'}), 400
     try:
-        result = predict_from_package(country, start_date)
+        result = cached_predict(country, start_date)
         return jsonify(result)
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
+# -------------------------------
+# Endpoint: Batch Prediction
+# -------------------------------
+@app.route('/api/predict/batch', methods=['POST'])
+def predict_batch_route():
+    """
+    Predicts every country x start date combination in one request.
+    Countries run in parallel on the shared prediction pool and each one is
+    streamed back as soon as it finishes.
+    JSON body:
+      - countries: list of country names
+      - start_dates: list of start dates (YYYY-MM-DD)
+    Response format is NDJSON by default; SSE when `?format=sse` is passed or
+    the client sends `Accept: text/event-stream`.
+    """
+    payload = request.get_json(force=True, silent=True)
+    if not isinstance(payload, dict):
+        return jsonify({'error': 'JSON object body required'}), 400
+    countries = payload.get('countries') or []
+    start_dates = payload.get('start_dates') or []
+    if not isinstance(countries, list) or not isinstance(start_dates, list):
+        return jsonify({'error': 'countries and start_dates must be lists'}), 400
+    if not all(isinstance(v, str) for v in countries + start_dates):
+        return jsonify({'error': 'countries and start_dates must contain strings'}), 400
+    # Deduplicate while keeping the requested order
+    countries = list(dict.fromkeys(c.lower() for c in countries if c))
+    start_dates = list(dict.fromkeys(d for d in start_dates if d))
+    if not countries or not start_dates:
+        return jsonify({'error': 'countries and start_dates required'}), 400
+    if len(countries) * len(start_dates) > PREDICT_BATCH_MAX:
+        return jsonify({'error': f'batch too large: {len(countries)} countries x {len(start_dates)} start dates exceeds {PREDICT_BATCH_MAX}'}), 400
+
+    fmt = request.args.get('format')
+    if fmt is None:
+        fmt = 'sse' if 'text/event-stream' in request.headers.get('Accept', '') else 'ndjson'
+    if fmt not in ('ndjson', 'sse'):
+        return jsonify({'error': f'unsupported format: {fmt}'}), 400
+
+    def encode(obj):
+        if fmt == 'sse':
+            return f"data: {json.dumps(obj)}\n\n"
+        return json.dumps(obj) + "\n"
+
+    futures = {predict_executor.submit(predict_country_batch, country, start_dates): country for country in countries}
+
+    def generate():
+        done = 0
+        for future in as_completed(futures):
+            done += 1
+            try:
+                item = future.result()
+            except Exception as e:
+                item = {"country": futures[future], "error": str(e)}
+            item["progress"] = int(done / len(futures) * 100)
+            yield encode(item)
+        if fmt == 'sse':
+            yield encode({"progress": 100, "phase": "done", "message": f"Predicted {len(futures)} countries"})
+
+    mimetype = 'text/event-stream' if fmt == 'sse' else 'application/x-ndjson'
+    return Response(generate(), mimetype=mimetype)
+
+# -------------------------------
+# Endpoint: Prediction model cache stats
+# -------------------------------
+@app.route('/api/predict/cache', methods=['GET'])
+def predict_cache_stats():
+    """Return hit/miss counters for the prediction model registry and result store."""
+    return jsonify({"models": model_registry.stats(), "results": prediction_store.stats()})
+
+# -------------------------------
+# Endpoint: Prediction pre-warm
+# -------------------------------
+@app.route('/api/predict/prewarm', methods=['GET', 'POST'])
+def predict_prewarm():
+    """
+    GET returns the status of the last pre-warm job.
+    POST {"weeks": N, "start_date": "YYYY-MM-DD"} starts materializing the next
+    N weekly predictions for every country in the package.
+    """
+    if request.method == 'GET':
+        return jsonify(prewarm_status)
+    if not prediction_store.enabled:
+        return jsonify({'error': 'prediction cache is disabled (PREDICT_CACHE_DB)'}), 400
+    if not os.path.exists(PACKAGE_PATH):
+        return jsonify({'error': f'{PACKAGE_PATH} not found'}), 404
+
+    payload = request.get_json(silent=True) or {}
+    weeks = int(payload.get('weeks', PREDICT_PREWARM_WEEKS or 4))
+    started = start_prewarm(weeks, payload.get('start_date'))
+    if not started:
+        return jsonify({'success': False, 'message': 'Pre-warm already running', 'status': prewarm_status}), 409
+    return jsonify({'success': True, 'message': f'Pre-warming {weeks} weeks', 'status': prewarm_status})
+
 # -------------------------------
 # Endpoint: Check Data
 # -------------------------------
@@ -413,11 +2750,8 @@ def check_data():
         print("False")
         modis_exists = False
 
-    if os.path.isdir("./data/modis"):
-        parquet_files = []
-        for root, dirs, files in os.walk("./data/modis"):
-            parquet_files.extend([f for f in files if f.endswith('.parquet')])
-        modis_exists = bool(parquet_files)
+    # Only year files count: derived entries (.cube, .catalog.json, ...) can exist without them
+    modis_exists = bool(year_file_paths("./data/modis"))
 
     return jsonify({
         "combined_exists": combined_exists,
@@ -463,6 +2797,70 @@ def set_data_setup():
     except Exception as e:
         return jsonify({"success": False, "error": str(e)}), 500
 
+# -------------------------------
+# Function: R2 download stream
+# -------------------------------
+def stream_r2_download(key, local_path, phase, message, error_prefix='Download error: '):
+    """
+    Download one R2 object on a background thread and yield SSE progress
+    messages as its bytes arrive (a heartbeat comment while none do).
+    Returns True once the file is complete, False after yielding an error.
+    """
+    try:
+        head = s3.head_object(Bucket=BUCKET_NAME, Key=key)
+        total_length = head['ContentLength'] or 1
+        channel = ProgressBus()
+        transferred = [0]
+
+        def callback(bytes_amount):
+            previous = transferred[0] * 100 // total_length
+            transferred[0] += bytes_amount
+            # Publish whole-percent steps only; boto calls this for every chunk
+            percent = transferred[0] * 100 // total_length
+            if percent != previous:
+                channel.publish(key, value=percent)
+
+        def download():
+            try:
+                s3.download_file(BUCKET_NAME, key, local_path, Callback=callback)
+                channel.publish(key, done=True)
+            except Exception as e:
+                channel.publish(key, done=True, error=str(e))
+
+        download_thread = threading.Thread(target=download)
+        download_thread.start()
+        version, state = channel.subscribe(key)
+        while not state.get("done"):
+            new_version, state = channel.wait(key, version, PROGRESS_HEARTBEAT)
+            if new_version == version:
+                yield ": heartbeat\n\n"
+                continue
+            version = new_version
+            if not state.get("done"):
+                yield f"data: {json.dumps({'progress': state['value'], 'phase': phase, 'message': message})}\n\n"
+        download_thread.join()
+        if state.get("error"):
+            yield f"data: {json.dumps({'progress': None, 'phase': 'error', 'message': error_prefix + state['error']})}\n\n"
+            return False
+        return True
+    except Exception as e:
+        yield f"data: {json.dumps({'progress': None, 'phase': 'error', 'message': error_prefix + str(e)})}\n\n"
+        return False
+
+# -------------------------------
+# Function: Download Combined Parquet stream
+# -------------------------------
+def download_data_stream(parquet_file):
+    """SSE messages of /api/download_data (also served by the ASGI entrypoint)"""
+    if os.path.exists(parquet_file):
+        yield f"data: {json.dumps({'progress': 100, 'phase': 'download skip', 'message': 'combined.parquet already exists'})}\n\n"
+        return
+
+    yield f"data: {json.dumps({'progress': 0, 'phase': 'download', 'message': 'combined.parquet not found. Starting download.'})}\n\n"
+    if not (yield from stream_r2_download(FILE_KEY_1, parquet_file, 'download', 'Downloading combined.parquet')):
+        return
+    yield f"data: {json.dumps({'progress': 100, 'phase': 'download complete', 'message': 'Download complete'})}\n\n"
+
 # -------------------------------
 # Endpoint: Download Combined Parquet
 # -------------------------------
@@ -477,50 +2875,21 @@ def download_data():
     """
     drive_url = request.args.get('drive_url', f"{CONNECTION_URL}/{BUCKET_NAME}/{FILE_KEY_1}")
     parquet_file = request.args.get('parquet_file', LOCAL_PARQUET)
+    return Response(download_data_stream(parquet_file), mimetype='text/event-stream')
 
-    def generate():
-        if os.path.exists(parquet_file):
-            yield f"data: {json.dumps({'progress': 100, 'phase': 'download skip', 'message': 'combined.parquet already exists'})}\n\n"
-            return
-
-        yield f"data: {json.dumps({'progress': 0, 'phase': 'download', 'message': 'combined.parquet not found. Starting download.'})}\n\n"
-        try:
-            head = s3.head_object(Bucket=BUCKET_NAME, Key=FILE_KEY_1)
-            total_length = head['ContentLength']
-            progress_obj = {"transferred": 0, "total": total_length}
-            download_error = [None]
-
-            class ProgressPercentage:
-                def __init__(self, progress):
-                    self._progress = progress
-
-                def __call__(self, bytes_amount):
-                    self._progress["transferred"] += bytes_amount
-
-            callback = ProgressPercentage(progress_obj)
-
-            def download():
-                try:
-                    s3.download_file(BUCKET_NAME, FILE_KEY_1, parquet_file, Callback=callback)
-                except Exception as e:
-                    download_error[0] = str(e)
-
-            download_thread = threading.Thread(target=download)
-            download_thread.start()
-            while download_thread.is_alive():
-                current_progress = int((progress_obj["transferred"] / progress_obj["total"]) * 100)
-                yield f"data: {json.dumps({'progress': current_progress, 'phase': 'download', 'message': 'Downloading combined.parquet'})}\n\n"
-                time.sleep(0.5)
-            download_thread.join()
-            if download_error[0]:
-                yield f"data: {json.dumps({'progress': None, 'phase': 'error', 'message': 'Download error: ' + download_error[0]})}\n\n"
-                return
-            yield f"data: {json.dumps({'progress': 100, 'phase': 'download complete', 'message': 'Download complete'})}\n\n"
-        except Exception as e:
-            yield f"data: {json.dumps({'progress': None, 'phase': 'error', 'message': 'Download error: ' + str(e)})}\n\n"
-            return
+# -------------------------------
+# Function: Download Model stream
+# -------------------------------
+def download_model_stream():
+    """SSE messages of /api/download_model (also served by the ASGI entrypoint)"""
+    if os.path.exists(LOCAL_MODEL):
+        yield f"data: {json.dumps({'progress': 100, 'phase': 'download skip', 'message': 'predict_package.model already exists'})}\n\n"
+        return
 
-    return Response(generate(), mimetype='text/event-stream')
+    yield f"data: {json.dumps({'progress': 0, 'phase': 'download', 'message': 'predict_package.model not found. Starting download.'})}\n\n"
+    if not (yield from stream_r2_download(FILE_KEY_2, LOCAL_MODEL, 'download', 'Downloading predict_package.model')):
+        return
+    yield f"data: {json.dumps({'progress': 100, 'phase': 'download complete', 'message': 'Download complete'})}\n\n"
 
 # -------------------------------
 # Endpoint: Download Model
@@ -531,50 +2900,35 @@ def download_model():
     Downloads the predict_package.model file from R2 if not already present.
     Streams progress updates as SSE messages.
     """
+    return Response(download_model_stream(), mimetype='text/event-stream')
 
-    def generate():
-        if os.path.exists(LOCAL_MODEL):
-            yield f"data: {json.dumps({'progress': 100, 'phase': 'download skip', 'message': 'predict_package.model already exists'})}\n\n"
+# -------------------------------
+# Function: Download Both Files stream
+# -------------------------------
+def download_all_stream():
+    """SSE messages of /api/download_all (also served by the ASGI entrypoint)"""
+    # Check and download the parquet file first
+    if os.path.exists(LOCAL_PARQUET):
+        yield f"data: {json.dumps({'progress': 100, 'phase': 'download skip', 'message': 'combined.parquet already exists'})}\n\n"
+    else:
+        yield f"data: {json.dumps({'progress': 0, 'phase': 'download parquet', 'message': 'combined.parquet not found. Starting download.'})}\n\n"
+        if not (yield from stream_r2_download(FILE_KEY_1, LOCAL_PARQUET, 'download parquet', 'Downloading combined.parquet',
+                                              'Download error for parquet: ')):
             return
+        yield f"data: {json.dumps({'progress': 100, 'phase': 'download parquet complete', 'message': 'Parquet download complete'})}\n\n"
 
-        yield f"data: {json.dumps({'progress': 0, 'phase': 'download', 'message': 'predict_package.model not found. Starting download.'})}\n\n"
-        try:
-            head = s3.head_object(Bucket=BUCKET_NAME, Key=FILE_KEY_2)
-            total_length = head['ContentLength']
-            progress_obj = {"transferred": 0, "total": total_length}
-            download_error = [None]
-
-            class ProgressPercentage:
-                def __init__(self, progress):
-                    self._progress = progress
-
-                def __call__(self, bytes_amount):
-                    self._progress["transferred"] += bytes_amount
-
-            callback = ProgressPercentage(progress_obj)
-
-            def download():
-                try:
-                    s3.download_file(BUCKET_NAME, FILE_KEY_2, LOCAL_MODEL, Callback=callback)
-                except Exception as e:
-                    download_error[0] = str(e)
-
-            download_thread = threading.Thread(target=download)
-            download_thread.start()
-            while download_thread.is_alive():
-                current_progress = int((progress_obj["transferred"] / progress_obj["total"]) * 100)
-                yield f"data: {json.dumps({'progress': current_progress, 'phase': 'download', 'message': 'Downloading predict_package.model'})}\n\n"
-                time.sleep(0.5)
-            download_thread.join()
-            if download_error[0]:
-                yield f"data: {json.dumps({'progress': None, 'phase': 'error', 'message': 'Download error: ' + download_error[0]})}\n\n"
-                return
-            yield f"data: {json.dumps({'progress': 100, 'phase': 'download complete', 'message': 'Download complete'})}\n\n"
-        except Exception as e:
-            yield f"data: {json.dumps({'progress': None, 'phase': 'error', 'message': 'Download error: ' + str(e)})}\n\n"
+    # Now check and download the model file
+    if os.path.exists(LOCAL_MODEL):
+        yield f"data: {json.dumps({'progress': 100, 'phase': 'download skip', 'message': 'predict_package.model already exists'})}\n\n"
+    else:
+        yield f"data: {json.dumps({'progress': 0, 'phase': 'download model', 'message': 'predict_package.model not found. Starting download.'})}\n\n"
+        if not (yield from stream_r2_download(FILE_KEY_2, LOCAL_MODEL, 'download model', 'Downloading predict_package.model',
+                                              'Download error for model: ')):
             return
+        yield f"data: {json.dumps({'progress': 100, 'phase': 'download model complete', 'message': 'Model download complete'})}\n\n"
 
-    return Response(generate(), mimetype='text/event-stream')
+    # All downloads complete
+    yield f"data: {json.dumps({'progress': 100, 'phase': 'all complete', 'message': 'All downloads complete'})}\n\n"
 
 # -------------------------------
 # Endpoint: Download Both Files
@@ -585,94 +2939,27 @@ def download_all():
     Downloads both combined.parquet and predict_package.model files from R2 if not already present.
     Streams progress updates as SSE messages for both files sequentially.
     """
+    return Response(download_all_stream(), mimetype='text/event-stream')
 
-    def generate():
-        # Check and download the parquet file first
-        if os.path.exists(LOCAL_PARQUET):
-            yield f"data: {json.dumps({'progress': 100, 'phase': 'download skip', 'message': 'combined.parquet already exists'})}\n\n"
-        else:
-            yield f"data: {json.dumps({'progress': 0, 'phase': 'download parquet', 'message': 'combined.parquet not found. Starting download.'})}\n\n"
-            try:
-                head = s3.head_object(Bucket=BUCKET_NAME, Key=FILE_KEY_1)
-                total_length = head['ContentLength']
-                progress_obj = {"transferred": 0, "total": total_length}
-                download_error = [None]
-
-                class ProgressPercentage:
-                    def __init__(self, progress):
-                        self._progress = progress
-
-                    def __call__(self, bytes_amount):
-                        self._progress["transferred"] += bytes_amount
-
-                callback = ProgressPercentage(progress_obj)
-
-                def download():
-                    try:
-                        s3.download_file(BUCKET_NAME, FILE_KEY_1, LOCAL_PARQUET, Callback=callback)
-                    except Exception as e:
-                        download_error[0] = str(e)
-
-                download_thread = threading.Thread(target=download)
-                download_thread.start()
-                while download_thread.is_alive():
-                    current_progress = int((progress_obj["transferred"] / progress_obj["total"]) * 100)
-                    yield f"data: {json.dumps({'progress': current_progress, 'phase': 'download parquet', 'message': 'Downloading combined.parquet'})}\n\n"
-                    time.sleep(0.5)
-                download_thread.join()
-                if download_error[0]:
-                    yield f"data: {json.dumps({'progress': None, 'phase': 'error', 'message': 'Download error for parquet: ' + download_error[0]})}\n\n"
-                    return
-                yield f"data: {json.dumps({'progress': 100, 'phase': 'download parquet complete', 'message': 'Parquet download complete'})}\n\n"
-            except Exception as e:
-                yield f"data: {json.dumps({'progress': None, 'phase': 'error', 'message': 'Download error for parquet: ' + str(e)})}\n\n"
-                return
-
-        # Now check and download the model file
-        if os.path.exists(LOCAL_MODEL):
-            yield f"data: {json.dumps({'progress': 100, 'phase': 'download skip', 'message': 'predict_package.model already exists'})}\n\n"
-        else:
-            yield f"data: {json.dumps({'progress': 0, 'phase': 'download model', 'message': 'predict_package.model not found. Starting download.'})}\n\n"
-            try:
-                head = s3.head_object(Bucket=BUCKET_NAME, Key=FILE_KEY_2)
-                total_length = head['ContentLength']
-                progress_obj = {"transferred": 0, "total": total_length}
-                download_error = [None]
-
-                class ProgressPercentage:
-                    def __init__(self, progress):
-                        self._progress = progress
-
-                    def __call__(self, bytes_amount):
-                        self._progress["transferred"] += bytes_amount
-
-                callback = ProgressPercentage(progress_obj)
-
-                def download():
-                    try:
-                        s3.download_file(BUCKET_NAME, FILE_KEY_2, LOCAL_MODEL, Callback=callback)
-                    except Exception as e:
-                        download_error[0] = str(e)
-
-                download_thread = threading.Thread(target=download)
-                download_thread.start()
-                while download_thread.is_alive():
-                    current_progress = int((progress_obj["transferred"] / progress_obj["total"]) * 100)
-                    yield f"data: {json.dumps({'progress': current_progress, 'phase': 'download model', 'message': 'Downloading predict_package.model'})}\n\n"
-                    time.sleep(0.5)
-                download_thread.join()
-                if download_error[0]:
-                    yield f"data: {json.dumps({'progress': None, 'phase': 'error', 'message': 'Download error for model: ' + download_error[0]})}\n\n"
-                    return
-                yield f"data: {json.dumps({'progress': 100, 'phase': 'download model complete', 'message': 'Model download complete'})}\n\n"
-            except Exception as e:
-                yield f"data: {json.dumps({'progress': None, 'phase': 'error', 'message': 'Download error for model: ' + str(e)})}\n\n"
-                return
-
-        # All downloads complete
-        yield f"data: {json.dumps({'progress': 100, 'phase': 'all complete', 'message': 'All downloads complete'})}\n\n"
-
-    return Response(generate(), mimetype='text/event-stream')
+# -------------------------------
+# Function: Convert Data stream
+# -------------------------------
+def convert_data_stream(parquet_file, output_dir, layout, workers, arrow_copy=CONVERT_ARROW_COPY):
+    """SSE messages of /api/convert_data (also served by the ASGI entrypoint)"""
+    # If data/modis already holds year files, no conversion needed.
+    year_paths = year_file_paths(output_dir)
+    if year_paths:
+        if arrow_copy:
+            # Existing data: only add the Arrow copies that are missing or stale
+            for i, year_path in enumerate(year_paths):
+                if open_arrow_copy(year_path) is None:
+                    write_arrow_copy(year_path)
+                    yield f"data: {json.dumps({'progress': (i + 1) * 100 // len(year_paths), 'phase': 'arrow copy', 'message': f'Wrote {arrow_copy_path(year_path)}'})}\n\n"
+        yield f"data: {json.dumps({'progress': 100, 'phase': 'complete', 'message': 'data/modis already exists. No conversion needed.'})}\n\n"
+        return
+    yield f"data: {json.dumps({'progress': 0, 'phase': 'conversion', 'message': 'Starting conversion to CSV in data/modis'})}\n\n"
+    yield from split_parquet_by_year_stream(parquet_file, output_dir, layout, workers=max(1, workers),
+                                            arrow_copy=arrow_copy)
 
 # -------------------------------
 # Endpoint: Convert Data (Parquet -> data/modis)
@@ -685,19 +2972,19 @@ def convert_data():
     Query parameters:
       - parquet_file: Local filename (default: combined.parquet)
       - output_dir: output folder (default: data/modis)
+      - layout: "country" (sorted, country-aligned row groups) or "plain" (default: CONVERT_LAYOUT)
+      - workers: max worker processes for per-year writes (default: CONVERT_WORKERS)
+      - arrow_copy: also write memory-mappable Arrow IPC copies (default: CONVERT_ARROW_COPY)
     """
     parquet_file = request.args.get('parquet_file', LOCAL_PARQUET)
     output_dir = request.args.get('output_dir', os.path.join('data', 'modis'))
-
-    def generate():
-        # If data/modis exists and is non-empty, no conversion needed.
-        if os.path.isdir(output_dir) and os.listdir(output_dir):
-            yield f"data: {json.dumps({'progress': 100, 'phase': 'complete', 'message': 'data/modis already exists. No conversion needed.'})}\n\n"
-            return
-        yield f"data: {json.dumps({'progress': 0, 'phase': 'conversion', 'message': 'Starting conversion to CSV in data/modis'})}\n\n"
-        yield from split_parquet_by_year_stream(parquet_file, output_dir)
-
-    return Response(generate(), mimetype='text/event-stream')
+    layout = request.args.get('layout', CONVERT_LAYOUT)
+    if layout not in ('country', 'plain'):
+        return jsonify({'error': f'unsupported layout: {layout}'}), 400
+    workers = request.args.get('workers', CONVERT_WORKERS, type=int)
+    arrow_copy = request.args.get('arrow_copy', str(CONVERT_ARROW_COPY)).lower() in ("1", "true", "yes")
+    return Response(convert_data_stream(parquet_file, output_dir, layout, workers, arrow_copy),
+                    mimetype='text/event-stream')
 
 # -------------------------------
 # Endpoint: Years
@@ -706,10 +2993,7 @@ def convert_data():
 def get_years():
     """Return available years from the data folder"""
     try:
-        # List all parquet files in the data folder
-        parquet_files = glob.glob(os.path.join(DATA_FOLDER, "*.parquet"))
-        years = [os.path.splitext(os.path.basename(file))[0] for file in parquet_files]
-        return jsonify({"success": True, "years": sorted(years)})
+        return jsonify({"success": True, "years": data_catalog.years()})
     except Exception as e:
         return jsonify({"success": False, "error": str(e)}), 500
 
@@ -720,29 +3004,9 @@ def get_years():
 def get_analyze_countries():
     """Return all countries from the data"""
     try:
-        years = request.args.getlist('year')
-
-        # If specific years are provided, get countries from those years' data
-        if years:
-            countries = set()
-            for year in years:
-                file_path = os.path.join(DATA_FOLDER, f"{year}.parquet")
-                if os.path.exists(file_path):
-                    df = pd.read_parquet(file_path)
-                    countries.update(df['country'].unique())
-
-            countries = list(countries)
-        else:
-            # Otherwise, get all countries from all years
-            countries = set()
-            parquet_files = glob.glob(os.path.join(DATA_FOLDER, "*.parquet"))
-
-            for file in parquet_files:
-                df = pd.read_parquet(file)
-                countries.update(df['country'].unique())
-
-            countries = list(countries)
-
+        # Specific years if provided, otherwise all years
+        years = request.args.getlist('year') or None
+        countries = data_catalog.countries(years)
         return jsonify({"success": True, "countries": sorted(countries)})
     except Exception as e:
         return jsonify({"success": False, "error": str(e)}), 500
@@ -753,21 +3017,22 @@ def get_analyze_countries():
 @app.route('/api/countries', methods=['GET'])
 def get_countries():
     year = request.args.get('year')
-    # Path to the single Parquet file for this year
-    parquet_path = f'./data/modis/{year}.parquet'
+    entry = data_catalog.sync().get(str(year))
 
-    # Verify the file actually exists
-    if not os.path.exists(parquet_path):
+    # Verify the year file actually exists
+    if entry is None:
         return jsonify({'error': f'Parquet file for year {year} not found'}), 404
 
-    # Read just the 'country' column (assuming it exists)
-    df = pd.read_parquet(parquet_path, columns=['country'])
-
-    # Extract unique country names
-    countries = df['country'].unique().tolist()
+    # Countries in file order, as recorded in the catalog
+    return jsonify({'year': year, 'countries': list(entry["countries"])})
 
-    # Return a JSON response with the year and list of countries
-    return jsonify({'year': year, 'countries': countries})
+# ---------------------------------------------------
+# Endpoint: Data catalog
+# ---------------------------------------------------
+@app.route('/api/catalog', methods=['GET'])
+def get_catalog():
+    """Per-year row counts and date ranges, overall and per country"""
+    return jsonify({"success": True, "years": data_catalog.sync()})
 
 # ---------------------------------------------------
 # Endpoint: Get Map setup point for frontend
@@ -785,11 +3050,61 @@ def get_countries_meta():
         data = json.load(f)
     return jsonify(data)
 
+# ---------------------------------------------------
+# Function: Columnar map points
+# ---------------------------------------------------
+ARROW_STREAM_MIME = "application/vnd.apache.arrow.stream"
+# Low-cardinality map columns sent as dictionary indices instead of repeated values
+MAP_DICTIONARY_COLUMNS = ('acq_date', 'daynight', 'type', 'country')
+
+
+def wants_arrow(req):
+    """?format=arrow|json wins; otherwise an Accept header listing the Arrow stream type"""
+    fmt = req.args.get('format')
+    if fmt:
+        return fmt.lower() == 'arrow'
+    return ARROW_STREAM_MIME in req.headers.get('Accept', '')
+
+
+def arrow_points_response(table, req):
+    """
+    Map points as an Arrow IPC stream: lat/lon/brightness stay float64 (the
+    detail lookup matches them exactly), acq_time shrinks to int16 and the
+    MAP_DICTIONARY_COLUMNS are dictionary-encoded. Gzipped when accepted.
+    """
+    table = table.combine_chunks()
+    columns = []
+    for name in table.column_names:
+        column = table[name]
+        if name in MAP_DICTIONARY_COLUMNS:
+            column = pc.dictionary_encode(column)
+        elif name == 'acq_time':
+            column = column.cast(pa.int16())
+        columns.append(column)
+    table = pa.table(columns, names=table.column_names)
+
+    sink = pa.BufferOutputStream()
+    with pa.ipc.new_stream(sink, table.schema) as writer:
+        writer.write_table(table)
+    body = sink.getvalue().to_pybytes()
+
+    response = Response(mimetype=ARROW_STREAM_MIME)
+    if 'gzip' in req.headers.get('Accept-Encoding', ''):
+        body = gzip.compress(body, compresslevel=5)
+        response.headers['Content-Encoding'] = 'gzip'
+    response.set_data(body)
+    response.headers['Vary'] = 'Accept, Accept-Encoding'
+    return response
+
 # ---------------------------------------------------
 # Endpoint: Get basic data point
 # ---------------------------------------------------
 @app.route('/api/data', methods=['GET'])
 def get_data():
+    """
+    Fire points of one country-year for the map: JSON records by default,
+    an Arrow IPC stream with ?format=arrow or Accept: application/vnd.apache.arrow.stream
+    """
     year = request.args.get('year')
     country = request.args.get('country')
     # Replace underscores with spaces to match your naming convention
@@ -802,19 +3117,83 @@ def get_data():
     if not os.path.isfile(parquet_path):
         return jsonify({'error': 'Data not found'}), 404
 
-    # Read the Parquet file, including the 'country' column so we can filter
     cols_to_read = ['latitude', 'longitude', 'brightness', 'acq_date',
                     'acq_time', 'daynight', 'type', 'country']
-    df = pd.read_parquet(parquet_path, columns=cols_to_read)
+    table = year_tables.get(parquet_path, decode=False)
+    if table is not None:
+        # Filter the shared year table another endpoint already decoded
+        table = table.filter(pc.equal(table.column('country'), country)).select(cols_to_read)
+    else:
+        # Push the country filter down so country-sorted files only decode matching row groups
+        table = pq.read_table(parquet_path, columns=cols_to_read, filters=[('country', '=', country)])
+    if wants_arrow(request):
+        return arrow_points_response(table, request)
 
-    # Filter for the requested country
-    df_filtered = df[df['country'] == country]
+    # Convert to list of records (JSON) and return
+    return jsonify(table.to_pandas().to_dict(orient='records'))
 
-    # If you don't want to return the country in the final JSON, drop it
-    # df_filtered = df_filtered.drop(columns='country')
+# ---------------------------------------------------
+# Endpoint: Map points inside a viewport
+# ---------------------------------------------------
+@app.route('/api/data/viewport', methods=['GET'])
+def get_viewport_data():
+    """
+    Fire points of one year inside a bounding box, clustered below TILE_FULL_ZOOM.
+    Query parameters:
+      - year, zoom (map zoom level), bbox=west,south,east,north
+      - country: optional country filter
+      - format=arrow (or the Arrow Accept header) for an Arrow IPC stream
+    """
+    year = request.args.get('year')
+    country = request.args.get('country')
+    if not os.path.isfile(os.path.join(DATA_FOLDER, f"{year}.parquet")):
+        return jsonify({'error': 'Data not found'}), 404
+    try:
+        west, south, east, north = (float(v) for v in request.args.get('bbox', '').split(','))
+        zoom = int(float(request.args.get('zoom', TILE_FULL_ZOOM)))
+    except ValueError:
+        return jsonify({'error': 'bbox=west,south,east,north and a numeric zoom are required'}), 400
+    south, north = max(-90.0, min(south, north)), min(90.0, max(south, north))
+    west, east = max(-180.0, west), min(180.0, east)
+
+    table = tile_index.query(year, west, south, east, north, zoom, country)
+    if wants_arrow(request):
+        return arrow_points_response(table, request)
+    return jsonify(table.to_pylist())
 
-    # Convert to list of records (JSON) and return
-    return jsonify(df_filtered.to_dict(orient='records'))
+# ---------------------------------------------------
+# Endpoint: Heatmap cells for a country-year
+# ---------------------------------------------------
+@app.route('/api/data/heatmap', methods=['GET'])
+def get_heatmap_data():
+    """
+    Fire counts and mean brightness per lat/lon grid cell, for low-zoom map views.
+    Query parameters:
+      - year, country (optional: all countries of the year)
+      - resolution: cell size in degrees (default HEATMAP_RESOLUTION)
+      - start_date / end_date: optional acq_date range (YYYY-MM-DD)
+      - format=arrow (or the Arrow Accept header) for an Arrow IPC stream
+    """
+    year = request.args.get('year')
+    country = request.args.get('country') or None
+    start_date = request.args.get('start_date') or None
+    end_date = request.args.get('end_date') or None
+    file_path = os.path.join(DATA_FOLDER, f"{year}.parquet")
+    if not os.path.isfile(file_path):
+        return jsonify({'error': 'Data not found'}), 404
+    resolution = request.args.get('resolution', HEATMAP_RESOLUTION, type=float)
+    if not resolution or not 0.01 <= resolution <= 10:
+        return jsonify({'error': 'resolution must be between 0.01 and 10 degrees'}), 400
+
+    key = heatmap_cache.key_for(file_path, country, resolution, start_date, end_date)
+    cells = heatmap_cache.get(key)
+    if cells is None:
+        cells = heatmap_cells(file_path, country, resolution, start_date, end_date)
+        heatmap_cache.put(key, cells)
+
+    if wants_arrow(request):
+        return arrow_points_response(cells, request)
+    return jsonify(cells.to_pylist())
 
 # ---------------------------------------------------
 # Endpoint: Return details from input data point
@@ -836,36 +3215,13 @@ def get_detail():
     if not os.path.isfile(parquet_path):
         return jsonify({'error': f'{parquet_path} not found'}), 404
 
-    # Columns needed for final filtering
-    needed_cols = ['latitude', 'longitude', 'acq_date', 'acq_time', 'daynight', 'country', 'type', 'brightness', 'area']
-
-    # 1) Read only rows matching 'country' using filters (predicate pushdown)
-    #    This significantly reduces how much data is loaded if row group stats are available.
+    # Answer from the memory-mapped per-year index (built on first use, rebuilt when the file changes)
     try:
-        # 'filters' was added in PyArrow 0.15+; works best if your file's row groups are chunked by country
-        table = pq.read_table(
-            parquet_path,
-            columns=needed_cols,
-            filters=[('country', '=', country)]  # pushdown filter
-        )
-    except pa.lib.ArrowInvalid as e:
-        # If there's some mismatch or older version that doesn't support filters well, fallback to read all
-        # , columns=needed_cols
-        table = pq.read_table(parquet_path)
-
-    # Convert the filtered Arrow table to a Pandas DataFrame
-    df_country = table.to_pandas()
-
-    # 2) Now filter further by lat/long/date/time
-    #    If your lat/lon are stored as floats, consider converting lat_str/lon_str to floats for numeric comparisons
-    detail = df_country[
-        (df_country['latitude'].astype(str) == lat_str) &
-        (df_country['longitude'].astype(str) == lon_str) &
-        (df_country['acq_date'] == acq_date) &
-        (df_country['acq_time'].astype(str) == acq_time_str)
-    ]
+        detail = detail_index.lookup(year, country, lat_str, lon_str, acq_date, acq_time_str)
+    except ValueError:
+        return jsonify({'error': 'latitude and longitude must be numeric'}), 400
 
-    return jsonify(detail.to_dict(orient='records'))
+    return jsonify(detail)
 
 # ---------------------------------------------------
 # New Endpoint: Analyze Data
@@ -877,49 +3233,13 @@ def get_progress(session_id):
     """
 
     def generate():
-        global analysis_progress
-
-        if session_id not in analysis_progress:
-            analysis_progress[session_id] = {"value": 0, "last_update": time.time()}
-
-        print(f"Progress connection established for session {session_id}")
-
-        # Send initial progress
-        data = json.dumps({"progress": analysis_progress[session_id]["value"]})
-        yield f"data: {data}\n\n"
-
-        last_value = analysis_progress[session_id]["value"]
-
-        while True:
-            # Check if progress has been updated
-            if session_id in analysis_progress:
-                current_value = analysis_progress[session_id]["value"]
-                if current_value != last_value:
-                    data = json.dumps({"progress": current_value})
-                    yield f"data: {data}\n\n"
-                    print(f"Sent progress update to client: {current_value}%")  # Debug output
-                    last_value = current_value
-
-                    # If progress is 100% or 0%, break the loop after a short delay
-                    if current_value >= 100 or current_value == 0:
-                        time.sleep(1)  # Give the client time to process
-                        break
-
-                # Check for stale connections (no updates for 60 seconds)
-                if time.time() - analysis_progress[session_id]["last_update"] > 60:
-                    print(f"Session {session_id} timed out")
-                    break
-            else:
-                # Session no longer exists
-                break
-
-            time.sleep(0.5)  # Check every 500ms
-
-        # Clean up
-        if session_id in analysis_progress:
-            del analysis_progress[session_id]
-
-        print(f"Progress connection closed for session {session_id}")
+        stream = ProgressStream(session_id)
+        yield from stream.start()
+        while not stream.done:
+            # Sleep until the session publishes an update (or the heartbeat is due)
+            version, state = progress_bus.wait(session_id, stream.version, PROGRESS_HEARTBEAT)
+            yield from stream.advance(version, state)
+        stream.close()
 
     # Set response headers for SSE
     return Response(generate(), mimetype="text/event-stream")
@@ -928,32 +3248,33 @@ def get_progress(session_id):
 @app.route('/api/analyze/stop', methods=['POST'])
 def stop_analysis():
     """
-    Stop the analysis process
+    Stop one session's analysis (running or still queued)
     """
-    global should_stop_analysis
-    should_stop_analysis = True
-
     # Get session ID from request
-    data = request.json
-    session_id = data.get('session_id', 'default')
+    data = request.get_json(silent=True) or {}
+    session_id = data.get('session_id')
+    if not session_id:
+        return jsonify({'success': False, 'message': 'session_id required'}), 400
+
+    stopped = analysis_scheduler.cancel(session_id)
+    if not stopped and job_state.enabled:
+        # The job may be queued or running in another worker process, which polls for this
+        stopped = job_state.request_cancel(session_id)
 
-    # Reset progress to 0
-    progress_update(0, session_id)
+    # Reset progress to 0 and end the session's progress streams
+    progress_stopped(session_id)
 
     return jsonify({
         'success': True,
-        'message': 'Analysis stop signal sent'
+        'message': 'Analysis stop signal sent' if stopped else 'No running analysis for this session'
     })
 
 
 @app.route('/api/analyze', methods=['POST'])
 def analyze_data():
     """
-    Start an asynchronous analysis job and return the session ID immediately
+    Queue an asynchronous analysis job and return the session ID immediately
     """
-    global should_stop_analysis
-    should_stop_analysis = False  # Reset at the start
-
     # Generate a unique session ID for this analysis
     session_id = str(uuid.uuid4())
 
@@ -961,103 +3282,133 @@ def analyze_data():
         filters = request.json
         print(f"Starting analysis for session {session_id}")
 
+        # Forget finished sessions nobody came back for
+        results_store.purge_expired()
+        progress_bus.purge(RESULTS_TTL)
+
+        # Serve repeated filter sets straight from the result cache
+        cache_key = analysis_cache.key_for(filters)
+        found, cached = analysis_cache.get(cache_key)
+        if found:
+            if cached is not None:
+                results_store.put(session_id, cached)
+            progress_update(100, session_id)
+            print(f"Analysis cache hit for session {session_id}")
+            return jsonify({
+                "success": True,
+                "message": "Analysis served from cache. Use session_id to get results.",
+                "session_id": session_id,
+                "cached": True
+            })
+
         # Initial progress
         progress_update(0, session_id)
 
-        # Start a background thread to do the actual processing
-        def background_processing():
+        # Job run by the analysis scheduler; `cancel` is this session's stop token
+        def background_processing(cancel):
             try:
-                # Simulate first step of processing
-                time.sleep(1)
-                progress_update(25, session_id)
-
-                # Check if we should stop
-                if should_stop_analysis:
-                    progress_update(0, session_id)  # Reset progress
-                    return
-
                 # Load data based on selected years
                 years = filters.get('years', [])
                 if not years:
                     # If no years selected, use all years
-                    parquet_files = glob.glob(os.path.join(DATA_FOLDER, "*.parquet"))
-                    years = [os.path.splitext(os.path.basename(file))[0] for file in parquet_files]
-
-                # Initialize an empty DataFrame to store the combined data
-                all_data = pd.DataFrame()
-
-                # For each selected year, load and filter the data
-                for i, year in enumerate(years):
-                    # Check if we should stop
-                    if should_stop_analysis:
+                    years = available_years()
+
+                # Plan: size each year's source from file metadata, so progress
+                # follows the bytes actually read. Missing or stale cubes are
+                # built later, as part of their year's share of the work
+                planned = []
+                for year in years:
+                    if cancel.is_set():
                         progress_update(0, session_id)  # Reset progress
                         return
-
                     file_path = os.path.join(DATA_FOLDER, f"{year}.parquet")
                     if os.path.exists(file_path):
-                        df = pd.read_parquet(file_path)
-
-                        time.sleep(0.5)  # Simulate processing time
-                        current_progress = 25 + (i + 1) * 50 // len(years)
-                        progress_update(current_progress, session_id)
-
-                        # Apply filters
-                        df = apply_filters(df, filters)
-
-                        # Append to the combined data
-                        all_data = pd.concat([all_data, df])
-
-                if all_data.empty:
+                        planned.append((file_path, planned_source_bytes(file_path, filters)))
+                progress_update(PROGRESS_PLANNED, session_id)
+
+                total_bytes = sum(nbytes for _, nbytes in planned) or 1
+                read = {"bytes": 0, "progress": PROGRESS_PLANNED}
+
+                def advance(nbytes):
+                    # Runs after every row group: the finest point to honour a stop
+                    if cancel.is_set():
+                        raise AnalysisCancelled()
+                    read["bytes"] += nbytes
+                    # A source can change between planning and reading (e.g. a year got cached)
+                    value = min(PROGRESS_SCANNED,
+                                PROGRESS_PLANNED + (PROGRESS_SCANNED - PROGRESS_PLANNED) * read["bytes"] // total_bytes)
+                    if value > read["progress"]:
+                        read["progress"] = value
+                        progress_update(value, session_id)
+
+                # Aggregate each year on its own and merge the partial results,
+                # so the filtered rows of all years are never in memory together
+                aggregate = AnalysisAggregate()
+                for file_path, nbytes in planned:
+                    left = {"bytes": nbytes}
+
+                    def year_advance(step):
+                        # A year never moves progress past its planned share
+                        step = min(step, left["bytes"])
+                        left["bytes"] -= step
+                        advance(step)
+
+                    aggregate = aggregate.merge(year_aggregate(file_path, filters, year_advance))
+                    # Building a cube reads the year without reporting it: count
+                    # whatever is left of the year's share once it is done
+                    advance(left["bytes"])
+                progress_update(PROGRESS_SCANNED, session_id)
+
+                if aggregate.empty:
+                    analysis_cache.put(cache_key, None)
                     progress_update(100, session_id)  # Set to complete
                     # No need to store results for empty data
                     return
 
                 # Check if we should stop
-                if should_stop_analysis:
+                if cancel.is_set():
                     progress_update(0, session_id)  # Reset progress
                     return
 
-                # Sleep for another second to simulate processing
-                time.sleep(1)
-                progress_update(90, session_id)
-                print(f"Analysis 90% complete for session {session_id}")
-
                 # Generate statistics and analysis results
-                results = generate_analysis(all_data)
+                results = aggregate.result()
 
-                # Store results in a global dictionary
-                # We need to store the results so they can be retrieved later
-                global analysis_results_storage
-                if not hasattr(app, 'analysis_results_storage'):
-                    app.analysis_results_storage = {}
-
-                app.analysis_results_storage[session_id] = {
+                # Store results so they can be retrieved later
+                stored = {
                     "success": True,
                     "message": "Analysis completed successfully",
                     "data": results["data"],
                     "stats": results["stats"]
                 }
+                results_store.put(session_id, stored)
+                analysis_cache.put(cache_key, stored)
 
                 # Final processing
                 progress_update(100, session_id)
                 print(f"Analysis 100% complete for session {session_id}")
 
+            except AnalysisCancelled:
+                print(f"Analysis stopped for session {session_id}")
+                progress_update(0, session_id)  # Reset progress
             except Exception as e:
                 print(f"Error in background processing for session {session_id}: {str(e)}")
                 import traceback
                 traceback.print_exc()
                 progress_update(0, session_id)  # Reset progress on error
 
-        # Start the background thread
-        thread = threading.Thread(target=background_processing)
-        thread.daemon = True  # Daemon thread will be killed when the main process exits
-        thread.start()
+        # Queue the job; admission waits until its estimated memory fits the budget
+        try:
+            position = analysis_scheduler.submit(session_id, background_processing, estimate_analysis_cost(filters))
+        except Full as e:
+            progress_bus.discard(session_id)
+            return jsonify({"success": False, "error": str(e), "session_id": session_id}), 503
 
         # Return the session ID immediately so the client can start tracking progress
         return jsonify({
             "success": True,
             "message": "Analysis started. Use session_id to track progress and get results.",
-            "session_id": session_id
+            "session_id": session_id,
+            "queue_position": position
         })
 
     except Exception as e:
@@ -1068,19 +3419,46 @@ def analyze_data():
         return jsonify({"success": False, "error": str(e), "session_id": session_id}), 500
 
 
+@app.route('/api/analyze/jobs', methods=['GET'])
+def analysis_jobs():
+    """Return the analysis scheduler's worker, queue and memory usage."""
+    return jsonify(analysis_scheduler.stats())
+
+
+@app.route('/api/analyze/cache', methods=['GET'])
+def analysis_cache_stats():
+    """Return size and hit-rate metrics for the analysis result cache."""
+    return jsonify(analysis_cache.stats())
+
+
+@app.route('/api/data/cache', methods=['GET'])
+def year_table_cache_stats():
+    """Return memory and hit-rate metrics for the shared year table cache."""
+    return jsonify(year_tables.stats())
+
+
+@app.route('/api/analyze/results', methods=['GET'])
+def analysis_results_stats():
+    """Return memory/spill metrics for the per-session analysis results store."""
+    return jsonify(results_store.stats())
+
+
+@app.route('/api/analyze/shared', methods=['GET'])
+def shared_job_state_stats():
+    """Return row counts of the job state shared by worker processes."""
+    return jsonify({"pid": os.getpid(), **job_state.stats()})
+
+
 # Add a new endpoint to retrieve analysis results
 @app.route('/api/analysis_results/<session_id>', methods=['GET'])
 def get_analysis_results(session_id):
     """
     Retrieve the results of a completed analysis
     """
-    # Make sure the storage exists
-    if not hasattr(app, 'analysis_results_storage'):
-        app.analysis_results_storage = {}
-
-    # Check if results are available for this session
-    if session_id in app.analysis_results_storage:
-        return jsonify(app.analysis_results_storage[session_id])
+    # Check if results are available for this session (already serialized)
+    body = results_store.get(session_id)
+    if body is not None:
+        return Response(body, mimetype='application/json')
     else:
         return jsonify({
             "success": False,
@@ -1099,6 +3477,20 @@ def prediction():
     return render_template("prediction.html")
 
 
-if __name__ == '__main__':
+# -------------------------------
+# Function: Startup
+# -------------------------------
+def start_background_services(prewarm=True):
+    """
+    Per-process startup shared by `python app.py`, the ASGI entrypoint and the
+    gunicorn workers: create the data folder and start the optional prediction
+    prewarm (in one worker only when there are several)
+    """
     os.makedirs(os.path.join('data', 'modis'), exist_ok=True)
+    if prewarm and PREDICT_PREWARM_WEEKS > 0 and prediction_store.enabled and os.path.exists(PACKAGE_PATH):
+        start_prewarm(PREDICT_PREWARM_WEEKS)
+
+
+if __name__ == '__main__':
+    start_background_services()
     app.run(host="0.0.0.0", port=5000, debug=False)
\ No newline at end of file
@@ -0,0 +1,137 @@
+"""
+ASGI entrypoint for the backend.
+
+Long-lived streams run on the event loop: /api/progress waits on the progress
+bus without holding a thread, and the download/conversion streams are stepped
+on a small executor so their blocking S3 and CPU-heavy Parquet work never runs
+on the loop. Every other route is the unchanged Flask app, served from its own
+thread pool, so /api/data and /api/detail stay responsive while streams are open.
+
+    cd backend
+    uvicorn asgi:application --host 0.0.0.0 --port 5000
+"""
+import asyncio
+import os
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager
+
+from a2wsgi import WSGIMiddleware
+from starlette.applications import Starlette
+from starlette.responses import JSONResponse, StreamingResponse
+from starlette.routing import Mount, Route
+
+import app as backend
+
+ASGI_WSGI_THREADS = int(os.getenv("ASGI_WSGI_THREADS", "16"))  # threads serving the Flask routes
+ASGI_STREAM_WORKERS = int(os.getenv("ASGI_STREAM_WORKERS", "4"))  # concurrent download/conversion streams
+
+stream_executor = ThreadPoolExecutor(max_workers=ASGI_STREAM_WORKERS, thread_name_prefix="asgi-stream")
+
+
+# -------------------------------
+# Function: SSE helpers
+# -------------------------------
+def cors_headers(request):
+    """The CORS header Flask-CORS would add for the same origin"""
+    origin = request.headers.get("origin")
+    if origin in backend.CORS_ORIGINS:
+        return {"Access-Control-Allow-Origin": origin, "Vary": "Origin"}
+    return {}
+
+
+def sse(request, messages):
+    return StreamingResponse(messages, media_type="text/event-stream", headers=cors_headers(request))
+
+
+async def offload(generator):
+    """
+    Run a blocking SSE generator on stream_executor one message at a time,
+    so the event loop only ever awaits it.
+    """
+    loop = asyncio.get_running_loop()
+    finished = object()
+    while True:
+        message = await loop.run_in_executor(stream_executor, next, generator, finished)
+        if message is finished:
+            return
+        yield message
+
+
+def int_param(request, name, default):
+    """Integer query parameter, falling back to the default like Flask's type=int"""
+    try:
+        return int(request.query_params.get(name, default))
+    except (TypeError, ValueError):
+        return default
+
+
+# -------------------------------
+# Endpoint: Progress (event loop)
+# -------------------------------
+async def get_progress(request):
+    """/api/progress/<session_id>: suspended on the progress bus between updates"""
+    session_id = request.path_params["session_id"]
+
+    async def messages():
+        # Subscribing and closing read/write the shared job state (SQLite) when
+        # SHARED_STATE_DB is set, so they run off the event loop
+        stream = await asyncio.to_thread(backend.ProgressStream, session_id)
+        for message in stream.start():
+            yield message
+        while not stream.done:
+            version, state = await backend.progress_bus.wait_async(
+                session_id, stream.version, backend.PROGRESS_HEARTBEAT)
+            for message in stream.advance(version, state):
+                yield message
+        await asyncio.to_thread(stream.close)
+
+    return sse(request, messages())
+
+
+# -------------------------------
+# Endpoint: Downloads and conversion (executor)
+# -------------------------------
+async def download_data(request):
+    parquet_file = request.query_params.get("parquet_file", backend.LOCAL_PARQUET)
+    return sse(request, offload(backend.download_data_stream(parquet_file)))
+
+
+async def download_model(request):
+    return sse(request, offload(backend.download_model_stream()))
+
+
+async def download_all(request):
+    return sse(request, offload(backend.download_all_stream()))
+
+
+async def convert_data(request):
+    parquet_file = request.query_params.get("parquet_file", backend.LOCAL_PARQUET)
+    output_dir = request.query_params.get("output_dir", os.path.join("data", "modis"))
+    layout = request.query_params.get("layout", backend.CONVERT_LAYOUT)
+    if layout not in ("country", "plain"):
+        return JSONResponse({"error": f"unsupported layout: {layout}"}, status_code=400,
+                            headers=cors_headers(request))
+    workers = int_param(request, "workers", backend.CONVERT_WORKERS)
+    arrow_copy = request.query_params.get("arrow_copy", str(backend.CONVERT_ARROW_COPY)).lower() in ("1", "true", "yes")
+    return sse(request, offload(backend.convert_data_stream(parquet_file, output_dir, layout, workers, arrow_copy)))
+
+
+@asynccontextmanager
+async def lifespan(_app):
+    backend.start_background_services()
+    yield
+    stream_executor.shutdown(wait=False, cancel_futures=True)
+
+
+application = Starlette(
+    routes=[
+        Route("/api/progress/{session_id}", get_progress, methods=["GET"]),
+        Route("/api/download_data", download_data, methods=["GET"]),
+        Route("/api/download_model", download_model, methods=["GET"]),
+        Route("/api/download_all", download_all, methods=["GET"]),
+        Route("/api/convert_data", convert_data, methods=["GET"]),
+        # Everything else: the Flask app on its own thread pool
+        Mount("/", app=WSGIMiddleware(backend.app, workers=ASGI_WSGI_THREADS)),
+    ],
+    lifespan=lifespan,
+)
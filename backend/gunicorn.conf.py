@@ -0,0 +1,28 @@
+"""
+gunicorn settings for serving the backend from several worker processes.
+
+    cd backend
+    gunicorn app:app
+
+Each worker is a separate process with its own GIL, so pandas/pyarrow work in
+concurrent requests runs on several cores. Job progress, stop requests and
+analysis results are kept in SHARED_STATE_DB, so any worker can answer
+/api/progress, /api/analyze/stop and /api/analysis_results for any session.
+"""
+import os
+
+# Next to app.py, outside the data folder (whose contents mark the data as converted)
+os.environ.setdefault("SHARED_STATE_DB", os.path.join(os.path.dirname(os.path.abspath(__file__)), "shared_state.sqlite"))
+
+bind = os.getenv("GUNICORN_BIND", "0.0.0.0:5000")
+workers = int(os.getenv("GUNICORN_WORKERS", str(min(4, os.cpu_count() or 1))))
+# SSE streams hold a request thread each, so every worker serves from a thread pool
+worker_class = "gthread"
+threads = int(os.getenv("GUNICORN_THREADS", "16"))
+
+
+def post_worker_init(worker):
+    import app
+
+    # The prediction prewarm runs in the first worker only
+    app.start_background_services(prewarm=worker.age == 1)